@@ -3,14 +3,26 @@
 # file LICENSE or http://www.opensource.org/licenses/mit-license.php.
 
 """
-This module provides the ASNEntry and ASMap classes.
+This module provides the ASNEntry, ASMap, CompiledASMap, IntervalASMap, ASMapLookupCache
+and MappedASMap classes.
 """
 
+import array
+import bisect
+import collections
+import concurrent.futures
 import copy
+import hashlib
 import ipaddress
+import mmap
+import os
 import random
+import subprocess
+import sys
 import unittest
-from collections.abc import Callable, Iterable
+import multiprocessing
+from multiprocessing import resource_tracker, shared_memory
+from collections.abc import Callable, Iterable, Iterator
 from enum import Enum
 from functools import total_ordering
 from typing import Optional, Union, overload
@@ -53,6 +65,23 @@ ASNEntry = tuple[list[bool], int]
 # Shortcut for (prefix, old ASN, new ASN) entries.
 ASNDiff = tuple[list[bool], int, int]
 
+# Variants of ASNEntry and ASNDiff with prefixes as (network address, prefix length) pairs,
+# where the network address is a 128-bit integer.
+IntASNEntry = tuple[tuple[int, int], int]
+IntASNDiff = tuple[tuple[int, int], int, int]
+
+# The bits of every byte value, most significant first, as bools.
+_BYTE_BITS = [tuple(((byte >> (7 - i)) & 1) != 0 for i in range(8)) for byte in range(256)]
+
+def _int_to_prefix(netrange: int, num_bits: int) -> list[bool]:
+    """Convert a 128-bit network address and prefix length to a list of bits."""
+    num_bytes = (num_bits + 7) >> 3
+    ret: list[bool] = []
+    for byte in (netrange >> (128 - 8 * num_bytes)).to_bytes(num_bytes, 'big'):
+        ret += _BYTE_BITS[byte]
+    del ret[num_bits:]
+    return ret
+
 class _VarLenCoder:
     """
     A class representing a custom variable-length binary encoder/decoder for
@@ -81,63 +110,88 @@ class _VarLenCoder:
         self._minval = minval
         self._clsbits = clsbits
         self._maxval = minval + sum(1 << b for b in clsbits) - 1
+        # Decoding table, indexed by class k: (number of prefix bits, number of value bits,
+        # first value in the class).
+        self._dectable: list[tuple[int, int, int]] = []
+        # Encoding tables, indexed by class k: the first value in the class, and (prefix
+        # bits shifted into place, total number of bits).
+        self._bases: list[int] = []
+        self._enctable: list[tuple[int, int]] = []
+        base = minval
+        for k, bits in enumerate(clsbits):
+            prebits = k + (k + 1 < len(clsbits))
+            self._dectable.append((prebits, bits, base))
+            self._bases.append(base)
+            self._enctable.append((((1 << k) - 1) << (prebits - k + bits), prebits + bits))
+            base += 1 << bits
+        assert max(pre + bits for pre, bits, _ in self._dectable) <= 64 - 7
 
     def can_encode(self, val: int) -> bool:
         """Check whether value val is in the range this coder supports."""
         return self._minval <= val <= self._maxval
 
-    def encode(self, val: int, ret: list[int]) -> None:
-        """Append encoding of val onto integer list ret."""
-
+    def encode_bits(self, val: int) -> tuple[int, int]:
+        """
+        Compute the encoding of val as an integer, plus the number of bits in it. The
+        first bit of the encoding is the most significant bit of the integer.
+        """
         assert self._minval <= val <= self._maxval
-        val -= self._minval
-        bits = 0
-        for k, bits in enumerate(self._clsbits):
-            if val >> bits:
-                # If the value will not fit in class k, subtract its range from v,
-                # emit a "1" bit and continue with the next class.
-                val -= 1 << bits
-                ret.append(1)
-            else:
-                if k + 1 < len(self._clsbits):
-                    # Unless we're in the last class, emit a "0" bit.
-                    ret.append(0)
-                break
-        # And then encode v (now the position within the class) in big endian.
-        ret.extend((val >> (bits - 1 - b)) & 1 for b in range(bits))
+        k = bisect.bisect_right(self._bases, val) - 1
+        prefix, nbits = self._enctable[k]
+        # The prefix bits, followed by the position within the class in big endian.
+        return prefix | (val - self._bases[k]), nbits
 
     def encode_size(self, val: int) -> int:
         """Compute how many bits are needed to encode val."""
         assert self._minval <= val <= self._maxval
-        val -= self._minval
-        ret = 0
-        bits = 0
-        for k, bits in enumerate(self._clsbits):
-            if val >> bits:
-                val -= 1 << bits
-                ret += 1
-            else:
-                ret += k + 1 < len(self._clsbits)
-                break
-        return ret + bits
-
-    def decode(self, stream, bitpos) -> tuple[int,int]:
-        """Decode a number starting at bitpos in stream, returning value and new bitpos."""
-        val = self._minval
-        bits = 0
-        for k, bits in enumerate(self._clsbits):
-            bit = 0
-            if k + 1 < len(self._clsbits):
-                bit = stream[bitpos]
-                bitpos += 1
-            if not bit:
-                break
-            val += 1 << bits
-        for i in range(bits):
-            bit = stream[bitpos]
-            bitpos += 1
-            val += bit << (bits - 1 - i)
-        return val, bitpos
+        return self._enctable[bisect.bisect_right(self._bases, val) - 1][1]
+
+    def decode(self, stream: bytes, bitpos: int, raw: bool = False) -> tuple[int,int]:
+        """
+        Decode a number starting at bitpos in stream, returning value and new bitpos.
+
+        Unless raw is set, the stream must be in the format produced by _BitStream: bit
+        order within each byte reversed, and padded with at least 8 zero bytes. If raw
+        is set, stream can be any buffer with binary asmap data in its original format.
+        """
+        # Load the next 64 bits, aligned so that the bit at bitpos is the top bit.
+        byte = bitpos >> 3
+        chunk = stream[byte:byte + 8]
+        if raw:
+            chunk = chunk.translate(_REVERSE_BITS).ljust(8, b'\0')
+        window = (int.from_bytes(chunk, 'big') << (bitpos & 7)) & 0xFFFFFFFFFFFFFFFF
+        # The class is the number of leading 1 bits (capped at the last class).
+        k = 64 - (window ^ 0xFFFFFFFFFFFFFFFF).bit_length()
+        if k >= len(self._dectable):
+            k = len(self._dectable) - 1
+        prebits, bits, base = self._dectable[k]
+        bitpos += prebits + bits
+        return base + ((window >> (64 - prebits - bits)) & ((1 << bits) - 1)), bitpos
+
+# Table to reverse the order of the bits in a byte.
+_REVERSE_BITS = bytes(int(f"{i:08b}"[::-1], 2) for i in range(256))
+
+class _BitStream:
+    """
+    A read-only view of binary asmap data as a sequence of bits, for use with
+    _VarLenCoder.decode.
+
+    The asmap format stores bits starting at the least significant bit of every byte.
+    This reverses every byte (so that consecutive bits can be read with a single
+    big-endian integer conversion) and adds zero padding at the end.
+    """
+
+    def __init__(self, bindata: bytes):
+        """Construct a _BitStream for bindata."""
+        self.data = bytes(bindata).translate(_REVERSE_BITS) + bytes(8)
+        self.nbits = len(bindata) * 8
+
+    def is_zero(self, bitpos: int) -> bool:
+        """Determine whether all bits from position bitpos on are zero."""
+        byte = bitpos >> 3
+        if self.data[byte] & (0xFF >> (bitpos & 7)):
+            return False
+        return not any(self.data[byte + 1:])
 
 # Variable-length encoders used in the binary asmap format.
 _CODER_INS = _VarLenCoder(0, [0, 0, 1])
@@ -176,6 +230,12 @@ class _Instruction(Enum):
 class _BinNode:
     """A class representing a (node of) the parsed binary asmap format."""
 
+    # Encodings of the instructions, as (bits, number of bits) pairs.
+    _RETURN_CODE = _CODER_INS.encode_bits(_Instruction.RETURN.value)
+    _JUMP_CODE = _CODER_INS.encode_bits(_Instruction.JUMP.value)
+    _MATCH_CODE = _CODER_INS.encode_bits(_Instruction.MATCH.value)
+    _DEFAULT_CODE = _CODER_INS.encode_bits(_Instruction.DEFAULT.value)
+
     @overload
     def __init__(self, ins: _Instruction): ...
     @overload
@@ -197,25 +257,27 @@ class _BinNode:
         self.ins = ins
         self.arg1 = arg1
         self.arg2 = arg2
-        if ins == _Instruction.RETURN:
+        # Whether to_binary should remember the encoding of this node in self.bits.
+        self.cache_bits = False
+        self.bits: Optional[int] = None
+        if ins is _Instruction.RETURN:
             assert isinstance(arg1, int)
             assert arg2 is None
-            self.size = _CODER_INS.encode_size(ins.value) + _CODER_ASN.encode_size(arg1)
-        elif ins == _Instruction.JUMP:
+            self.size = self._RETURN_CODE[1] + _CODER_ASN.encode_size(arg1)
+        elif ins is _Instruction.JUMP:
             assert isinstance(arg1, _BinNode)
             assert isinstance(arg2, _BinNode)
-            self.size = (_CODER_INS.encode_size(ins.value) + _CODER_JUMP.encode_size(arg1.size) +
+            self.size = (self._JUMP_CODE[1] + _CODER_JUMP.encode_size(arg1.size) +
                          arg1.size + arg2.size)
-        elif ins == _Instruction.DEFAULT:
+        elif ins is _Instruction.DEFAULT:
             assert isinstance(arg1, int)
             assert isinstance(arg2, _BinNode)
-            self.size = _CODER_INS.encode_size(ins.value) + _CODER_ASN.encode_size(arg1) + arg2.size
-        elif ins == _Instruction.MATCH:
+            self.size = self._DEFAULT_CODE[1] + _CODER_ASN.encode_size(arg1) + arg2.size
+        elif ins is _Instruction.MATCH:
             assert isinstance(arg1, int)
             assert isinstance(arg2, _BinNode)
-            self.size = (_CODER_INS.encode_size(ins.value) + _CODER_MATCH.encode_size(arg1)
-                         + arg2.size)
-        elif ins == _Instruction.END:
+            self.size = self._MATCH_CODE[1] + _CODER_MATCH.encode_size(arg1) + arg2.size
+        elif ins is _Instruction.END:
             assert arg1 is None
             assert arg2 is None
             self.size = 0
@@ -234,38 +296,128 @@ class _BinNode:
         return _BinNode(_Instruction.RETURN, val)
 
     @staticmethod
-    def make_branch(node0: "_BinNode", node1: "_BinNode") -> "_BinNode":
+    def make_branch(node0: "_BinNode", node1: "_BinNode",
+                    limit: Optional[int] = None) -> Optional["_BinNode"]:
         """
         Construct a _BinNode corresponding to running either the node0 or node1 subprogram,
         based on the next input bit. It exploits shortcuts that are possible in the encoding,
         and uses either a JUMP, MATCH, or END instruction.
+
+        If limit is given, None is returned instead of a node of size limit or more (without
+        constructing it).
         """
-        if node0.ins == _Instruction.END and node1.ins == _Instruction.END:
-            return node0
-        if node0.ins == _Instruction.END:
-            if node1.ins == _Instruction.MATCH and node1.arg1 <= 0xFF:
-                return _BinNode(node1.ins, node1.arg1 + (1 << node1.arg1.bit_length()), node1.arg2)
-            return _BinNode(_Instruction.MATCH, 3, node1)
-        if node1.ins == _Instruction.END:
-            if node0.ins == _Instruction.MATCH and node0.arg1 <= 0xFF:
-                return _BinNode(node0.ins, node0.arg1 + (1 << (node0.arg1.bit_length() - 1)),
-                                node0.arg2)
-            return _BinNode(_Instruction.MATCH, 2, node0)
+        if limit is None:
+            limit = sys.maxsize
+        if node0.ins is _Instruction.END and node1.ins is _Instruction.END:
+            return node0 if limit > 0 else None
+        if node0.ins is _Instruction.END or node1.ins is _Instruction.END:
+            if node0.ins is _Instruction.END:
+                sub = node1
+                # Matching a 1 bit: prepend a 1 bit to the match value.
+                extend = 1 << node1.arg1.bit_length() if node1.ins is _Instruction.MATCH else 0
+                val = 3
+            else:
+                sub = node0
+                # Matching a 0 bit: prepend a 0 bit (below the leading 1 bit).
+                extend = 1 << (node0.arg1.bit_length() - 1) if node0.ins is _Instruction.MATCH else 0
+                val = 2
+            if sub.ins is _Instruction.MATCH and sub.arg1 <= 0xFF:
+                val = sub.arg1 + extend
+                sub = sub.arg2
+            if _BinNode._MATCH_CODE[1] + _CODER_MATCH.encode_size(val) + sub.size >= limit:
+                return None
+            return _BinNode(_Instruction.MATCH, val, sub)
+        if (_BinNode._JUMP_CODE[1] + _CODER_JUMP.encode_size(node0.size) + node0.size +
+                node1.size >= limit):
+            return None
         return _BinNode(_Instruction.JUMP, node0, node1)
 
     @staticmethod
-    def make_default(val: int, sub: "_BinNode") -> "_BinNode":
+    def make_default(val: int, sub: "_BinNode",
+                     limit: Optional[int] = None) -> Optional["_BinNode"]:
         """
         Construct a _BinNode that corresponds to the specified subprogram, with the specified
         default value. It exploits shortcuts that are possible in the encoding, and will use
-        either a DEFAULT or a RETURN instruction."""
+        either a DEFAULT or a RETURN instruction.
+
+        If limit is given, None is returned instead of a node of size limit or more (without
+        constructing it)."""
         assert val is not None and val > 0
-        if sub.ins == _Instruction.END:
-            return _BinNode(_Instruction.RETURN, val)
-        if sub.ins in (_Instruction.RETURN, _Instruction.DEFAULT):
-            return sub
+        if limit is None:
+            limit = sys.maxsize
+        if sub.ins is _Instruction.RETURN or sub.ins is _Instruction.DEFAULT:
+            return sub if sub.size < limit else None
+        if sub.ins is _Instruction.END:
+            size = _BinNode._RETURN_CODE[1] + _CODER_ASN.encode_size(val)
+            return _BinNode(_Instruction.RETURN, val) if size < limit else None
+        if _BinNode._DEFAULT_CODE[1] + _CODER_ASN.encode_size(val) + sub.size >= limit:
+            return None
         return _BinNode(_Instruction.DEFAULT, val, sub)
 
+def _shard_entries(entries: list[ASNEntry],
+                   shard_size: int) -> tuple[list[ASNEntry], list[tuple[list[bool], list[ASNEntry]]]]:
+    """
+    Split entries into shards of at most shard_size entries (where possible). Returns the
+    entries that do not fit in any shard, and a list of (shard prefix, entries) pairs, where
+    the prefixes of all entries in a shard are strictly longer than the shard prefix.
+    """
+    top: list[ASNEntry] = []
+    shards: list[tuple[list[bool], list[ASNEntry]]] = []
+    stack = [([], entries)]
+    while stack:
+        prefix, group = stack.pop()
+        if len(group) <= shard_size:
+            if group:
+                shards.append((prefix, group))
+            continue
+        depth = len(prefix)
+        halves: tuple[list[ASNEntry], list[ASNEntry]] = ([], [])
+        for entry in group:
+            if len(entry[0]) <= depth:
+                top.append(entry)
+            else:
+                halves[entry[0][depth]].append(entry)
+        stack.append((prefix + [True], halves[1]))
+        stack.append((prefix + [False], halves[0]))
+    return top, shards
+
+def _build_shard(task: tuple[int, list[tuple[bytes, int]]]) -> array.array:
+    """
+    Build the subtrie for a shard, given its initial ASN and its entries (with the shard
+    prefix removed, and packed using bytes() to keep them cheap to send to a worker).
+
+    This runs in worker processes. To keep the result cheap to send back, the subtrie is
+    returned in pre-order, with -1 for inner nodes and the ASN for leaves.
+    """
+    asn, entries = task
+    shard = ASMap()
+    shard.update([], asn)
+    for prefix, entry_asn in sorted(entries, key=lambda entry: (len(entry[0]), entry)):
+        shard.update(list(map(bool, prefix)), entry_asn)
+    ret = array.array('q')
+    #pylint: disable=protected-access
+    stack = [shard._trie]
+    while stack:
+        node = stack.pop()
+        if len(node) == 1:
+            ret.append(node[0])
+        else:
+            ret.append(-1)
+            stack.append(node[1])
+            stack.append(node[0])
+    return ret
+
+def _trie_from_preorder(nodes: array.array) -> list:
+    """Construct a trie from the pre-order representation returned by _build_shard."""
+    stack: list[list] = []
+    for val in reversed(nodes):
+        if val >= 0:
+            stack.append([val])
+        else:
+            node0 = stack.pop()
+            stack.append([node0, stack.pop()])
+    return stack[0]
+
 @total_ordering
 class ASMap:
     """
@@ -280,17 +432,64 @@ class ASMap:
     - [int] means a subnet mapped entirely to the specified ASN.
     - [node,node] means a subnet whose lower half and upper half have different
     -             mappings, represented by new trie nodes.
+
+    update() modifies the nodes along the updated path in place, unless the trie may be
+    shared: in interning mode, after copy(), and for the operands and result of overlay().
+    Then it replaces those nodes instead, so that subtrees can be shared within a trie and
+    between ASMap objects. In interning mode, structurally identical subtrees are stored
+    only once (hash-consing), which substantially reduces memory usage for large maps.
     """
 
+    # Depth interval at which _to_binnode caches its results.
+    _ENCODING_CACHE_STRIDE = 8
+
     def update(self, prefix: list[bool], asn: int) -> None:
         """Update this ASMap object to map prefix to the specified asn."""
         assert asn == 0 or _CODER_ASN.can_encode(asn)
+        self._replace(prefix, self._make_leaf(asn))
+
+    def _replace(self, prefix: list[bool], subtrie: list) -> None:
+        """Replace the subtrie for prefix with a normalized subtrie. Internal use only."""
+        cached = bool(self._fingerprints or self._encodings)
+        if not self._shared:
+            self._replace_in_place(prefix, subtrie, cached)
+            return
+
+        def recurse(node: list, offset: int) -> list:
+            if cached:
+                # This node will be replaced; forget data cached for it.
+                self._forget(node, subtree=(offset == len(prefix)))
+            if offset == len(prefix):
+                # Reached the end of prefix; replace this node.
+                return subtrie
+            if len(node) == 1:
+                # Need to descend into a leaf node; split it up.
+                node0 = node1 = node
+            else:
+                node0, node1 = node
+            # Descend into the node.
+            if prefix[offset]:
+                node1 = recurse(node1, offset + 1)
+            else:
+                node0 = recurse(node0, offset + 1)
+            # If the result is two identical leaf children, merge them.
+            if len(node0) == 1 and len(node1) == 1 and node0[0] == node1[0]:
+                return node0
+            return [node0, node1]
+        self._trie = recurse(self._trie, 0)
+        self._invalidate()
+
+    def _replace_in_place(self, prefix: list[bool], subtrie: list, cached: bool) -> None:
+        """Like _replace, but modify the nodes along prefix. Internal use only."""
+        end = len(prefix)
 
         def recurse(node: list, offset: int) -> None:
-            if offset == len(prefix):
+            if cached:
+                # This node will be modified; forget data cached for it.
+                self._forget(node, subtree=(offset == end))
+            if offset == end:
                 # Reached the end of prefix; overwrite this node.
-                node.clear()
-                node.append(asn)
+                node[:] = subtrie
                 return
             if len(node) == 1:
                 # Need to descend into a leaf node; split it up.
@@ -306,6 +505,7 @@ class ASMap:
                 node.clear()
                 node.append(oldasn)
         recurse(self._trie, 0)
+        self._invalidate()
 
     def update_multi(self, entries: list[tuple[list[bool], int]]) -> None:
         """Apply multiple update operations, where longer prefixes take precedence."""
@@ -330,11 +530,70 @@ class ASMap:
                     node.clear()
                     node.append(asn)
         recurse(trie)
+        if self._leaves is not None:
+            trie = self._intern(trie)
         self._trie = trie
+        self._fingerprints = {}
+        self._encodings = {}
+        self._invalidate()
+
+    def _make_leaf(self, asn: int) -> list:
+        """Construct a leaf node for asn, reusing an existing one in interning mode."""
+        if self._leaves is None:
+            return [asn]
+        leaf = self._leaves.get(asn)
+        if leaf is None:
+            leaf = self._leaves[asn] = [asn]
+        return leaf
+
+    def _intern(self, trie: list) -> list:
+        """
+        Return a trie equivalent to the (normalized) trie argument, in which all
+        structurally identical subtrees are shared. Internal use only.
+        """
+        # Map from (id(node0) << 64) | id(node1) to the inner node with those children. The
+        # children are always interned nodes, which are kept alive by this table or
+        # self._leaves.
+        branches: dict[int, list] = {}
+
+        def recurse(node: list) -> list:
+            if len(node) == 1:
+                return self._make_leaf(node[0])
+            node0, node1 = recurse(node[0]), recurse(node[1])
+            key = (id(node0) << 64) | id(node1)
+            ret = branches.get(key)
+            if ret is None:
+                ret = branches[key] = [node0, node1]
+            return ret
+        return recurse(trie)
+
+    def _invalidate(self) -> None:
+        """Discard data derived from the trie, after it changed. Internal use only."""
+        self._interval_map: Optional[IntervalASMap] = None
+        self._asn_index: Optional[dict[int, list[tuple[int, int]]]] = None
+
+    def __init__(self, entries: Optional[Iterable[ASNEntry]] = None,
+                 intern: bool = False) -> None:
+        """
+        Construct an ASMap object from an optional list of entries.
 
-    def __init__(self, entries: Optional[Iterable[ASNEntry]] = None) -> None:
-        """Construct an ASMap object from an optional list of entries."""
+        If intern is set, the object is in interning mode: identical subtrees are shared
+        when constructing it from entries or from binary (see from_binary), leaf nodes
+        are shared by update(), and copies stay in interning mode.
+        """
+        # Map from ASN to the shared leaf node for it, in interning mode. None otherwise.
+        self._leaves: Optional[dict[int, list]] = None
+        # Whether nodes of self._trie may be shared, within the trie or with other objects,
+        # in which case _replace must not modify them in place.
+        self._shared = False
         self._trie = [0]
+        # Map from id(node) to the fingerprint of every inner node of self._trie whose
+        # fingerprint has been computed (see _fingerprint).
+        self._fingerprints: dict[int, bytes] = {}
+        # Map from id(node) * 2 + fill to the cached _to_binnode result for some inner
+        # nodes of self._trie (see _to_binnode).
+        self._encodings: dict[int, tuple[dict[Optional[int], _BinNode], bool]] = {}
+        self._invalidate()
         if entries is not None:
             def entry_key(entry):
                 """Sort function that places shorter prefixes first."""
@@ -342,6 +601,48 @@ class ASMap:
                 return len(prefix), prefix, asn
             for prefix, asn in sorted(entries, key=entry_key):
                 self.update(prefix, asn)
+        if intern:
+            # The entries are applied in place first, and only then shared.
+            self._leaves = {}
+            self._shared = True
+            self._trie = self._intern(self._trie)
+
+    @staticmethod
+    def from_entries(entries: Iterable[ASNEntry], jobs: Optional[int] = None,
+                     intern: bool = False, shard_size: Optional[int] = None) -> "ASMap":
+        """
+        Construct an ASMap object from a list of entries, like ASMap(entries, intern), but
+        building subtries in parallel using up to jobs worker processes (default: one per
+        CPU).
+
+        The entries are split into shards of at most shard_size entries (default: enough
+        for every worker to get a few), each covering the subnet of a common prefix. Entries
+        that are too short to belong to a single shard are applied first, and determine
+        the initial ASN of every shard. With jobs=1, shards are built in this process.
+        """
+        entries = list(entries)
+        if jobs is None:
+            jobs = os.cpu_count() or 1
+        if shard_size is None:
+            shard_size = max(1, -(-len(entries) // (jobs * 4)))
+        top, shards = _shard_entries(entries, shard_size)
+        ret = ASMap(top)
+        #pylint: disable=protected-access
+        tasks = [(ret.lookup(prefix),
+                  [(bytes(entry[len(prefix):]), asn) for entry, asn in shard])
+                 for prefix, shard in shards]
+        if jobs == 1 or len(tasks) <= 1:
+            subtries = list(map(_build_shard, tasks))
+        else:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+                subtries = list(executor.map(_build_shard, tasks))
+        for (prefix, _), subtrie in zip(shards, subtries):
+            ret._replace(prefix, _trie_from_preorder(subtrie))
+        if intern:
+            ret._leaves = {}
+            ret._shared = True
+            ret._trie = ret._intern(ret._trie)
+        return ret
 
     def lookup(self, prefix: list[bool]) -> Optional[int]:
         """Look up a prefix. Returns ASN, or 0 if unassigned, or None if indeterminate."""
@@ -354,27 +655,257 @@ class ASMap:
             return node[0]
         return None
 
-    def _to_entries_flat(self, fill: bool = False) -> list[ASNEntry]:
-        """Convert an ASMap object to a list of non-overlapping (prefix, asn) objects."""
-        prefix : list[bool] = []
-
-        def recurse(node: list) -> list[ASNEntry]:
-            ret = []
+    def lookup_range(self, prefix: list[bool]) -> list[ASNEntry]:
+        """
+        Look up all mappings within a prefix. Returns non-overlapping (prefix, asn) entries
+        for the assigned subnets of prefix, in address order. Subnets that are mapped as a
+        whole are not split up, and if all of prefix maps to one ASN, the result is just
+        (prefix, asn).
+        """
+        node = self._trie
+        for bit in prefix:
+            if len(node) == 1:
+                break
+            node = node[bit]
+        ret: list[ASNEntry] = []
+        stack = [(node, list(prefix))]
+        while stack:
+            node, subprefix = stack.pop()
             if len(node) == 1:
                 if node[0] > 0:
-                    ret = [(list(prefix), node[0])]
-            elif len(node) == 2:
-                prefix.append(False)
-                ret = recurse(node[0])
-                prefix[-1] = True
-                ret += recurse(node[1])
-                prefix.pop()
-                if fill and len(ret) > 1:
-                    asns = set(x[1] for x in ret)
-                    if len(asns) == 1:
-                        ret = [(list(prefix), list(asns)[0])]
+                    ret.append((subprefix, node[0]))
+            else:
+                stack.append((node[1], subprefix + [True]))
+                stack.append((node[0], subprefix + [False]))
+        return ret
+
+    def lookup_int(self, addr: int, is_v4: bool) -> int:
+        """
+        Look up a single address, given as an integer: a 32-bit IPv4 or a 128-bit IPv6
+        address. Returns ASN, or 0 if unassigned.
+        """
+        if is_v4:
+            addr |= 0xffff00000000
+        return self.lookup_covering(addr)[0]
+
+    def lookup_covering(self, addr: int) -> tuple[int, int]:
+        """
+        Look up a 128-bit address. Returns its ASN (0 if unassigned), and the length of the
+        shortest prefix of addr that is mapped to that ASN as a whole.
+        """
+        node = self._trie
+        depth = 0
+        while len(node) == 2:
+            node = node[(addr >> (127 - depth)) & 1]
+            depth += 1
+        return node[0], depth
+
+    def _to_intervals(self) -> list[tuple[int, int]]:
+        """
+        Convert the trie to a sorted list of (start, asn) pairs, where start is a 128-bit
+        integer. Every pair maps the addresses from its start up to the start of the
+        next pair to its ASN (0 if unassigned). The first pair starts at 0, and
+        consecutive pairs have different ASNs.
+        """
+        ret: list[tuple[int, int]] = []
+        stack = [(self._trie, 0, 127)]
+        while stack:
+            node, start, bit = stack.pop()
+            if len(node) == 1:
+                if not ret or ret[-1][1] != node[0]:
+                    ret.append((start, node[0]))
+            else:
+                stack.append((node[1], start | (1 << bit), bit - 1))
+                stack.append((node[0], start, bit - 1))
+        return ret
+
+    def to_interval_map(self) -> "IntervalASMap":
+        """Construct a read-only IntervalASMap object with the same mappings as this one."""
+        return IntervalASMap.from_intervals(self._to_intervals())
+
+    def lookup_many(self, addrs):
+        """
+        Look up many addresses at once, using NumPy. See IntervalASMap.lookup_many.
+
+        The IntervalASMap used for this is constructed on first use, and kept until
+        this object is modified.
+        """
+        if self._interval_map is None:
+            self._interval_map = self.to_interval_map()
+        return self._interval_map.lookup_many(addrs)
+
+    def lookup_asn(self, asn: int) -> list[list[bool]]:
+        """
+        Find the prefixes mapped to asn. Returns them in address order, as in the
+        non-overlapping entries of to_entries().
+
+        An index from ASN to prefixes is constructed on first use, and kept until this
+        object is modified.
+        """
+        if self._asn_index is None:
+            index: dict[int, list[tuple[int, int]]] = collections.defaultdict(list)
+            for prefix, entry_asn in self.iter_entries(as_int=True):
+                index[entry_asn].append(prefix)
+            self._asn_index = dict(index)
+        return [_int_to_prefix(start, length) for start, length in self._asn_index.get(asn, [])]
+
+    def memory_usage(self) -> dict[str, int]:
+        """
+        Report on the memory used by the trie. Returns a dictionary with:
+        - nodes: the number of nodes in the trie, counting shared nodes once per use
+        - unique_nodes: the number of distinct node objects
+        - bytes: the size of the distinct node objects (and ASN integers) in bytes
+        - unshared_bytes: the size in bytes the trie would have if nothing was shared
+        - table_bytes: the size of the interning table in bytes (0 if not interning)
+        """
+        # Map from id(node) to (number of nodes, unshared size) of the subtree.
+        seen: dict[int, tuple[int, int]] = {}
+        seen_asns: set[int] = set()
+        unique_bytes = 0
+
+        def recurse(node: list) -> tuple[int, int]:
+            nonlocal unique_bytes
+            ret = seen.get(id(node))
+            if ret is not None:
+                return ret
+            size = sys.getsizeof(node)
+            if len(node) == 1:
+                size += sys.getsizeof(node[0])
+                if id(node[0]) not in seen_asns:
+                    seen_asns.add(id(node[0]))
+                    unique_bytes += sys.getsizeof(node[0])
+                ret = (1, size)
+            else:
+                count0, size0 = recurse(node[0])
+                count1, size1 = recurse(node[1])
+                ret = (1 + count0 + count1, size + size0 + size1)
+            unique_bytes += sys.getsizeof(node)
+            seen[id(node)] = ret
             return ret
-        return recurse(self._trie)
+        nodes, unshared_bytes = recurse(self._trie)
+        table_bytes = 0
+        if self._leaves is not None:
+            table_bytes = sys.getsizeof(self._leaves)
+        return {'nodes': nodes, 'unique_nodes': len(seen), 'bytes': unique_bytes,
+                'unshared_bytes': unshared_bytes, 'table_bytes': table_bytes}
+
+    def compile(self, ipv4_table: bool = False) -> "CompiledASMap":
+        """
+        Construct a read-only CompiledASMap object with the same mappings as this one.
+
+        If ipv4_table is set, it also gets a direct-indexed table for IPv4 lookups, which
+        uses 64 MiB or more of memory (see CompiledASMap).
+        """
+        return CompiledASMap(self._trie, ipv4_table)
+
+    def _iter_flat(self, fill: bool = False) -> Iterator[tuple[int, int, int]]:
+        """
+        Generate the entries of _to_entries_flat lazily, as (network address, prefix
+        length, asn) tuples, where the network address is a 128-bit integer.
+
+        This uses an explicit stack rather than recursion. With fill, a subtree whose
+        entries all have the same ASN is collapsed into a single entry; as that is only
+        known once the whole subtree has been visited, the (at most one) entry for the
+        left child of every node on the stack is held back until it is clear whether it
+        can be collapsed into its parent.
+        """
+        if not fill:
+            stack = [(self._trie, 0, 0)]
+            while stack:
+                node, start, depth = stack.pop()
+                if len(node) == 1:
+                    if node[0] > 0:
+                        yield start, depth, node[0]
+                else:
+                    stack.append((node[1], start | (1 << (127 - depth)), depth + 1))
+                    stack.append((node[0], start, depth + 1))
+            return
+
+        # The result of a subtree is either None (no entries), a single entry, or MIXED
+        # (entries with different ASNs, all of which have been yielded already).
+        mixed = (0, 0, 0)
+        # Stack frames are [node, start, depth, state, left child result].
+        stack: list[list] = [[self._trie, 0, 0, 0, None]]
+        # Frames whose left child result is an entry that has not been yielded yet.
+        pending: list[list] = []
+        result: Optional[tuple[int, int, int]] = None
+        while stack:
+            frame = stack[-1]
+            node, start, depth, state, left = frame
+            if len(node) == 1:
+                result = (start, depth, node[0]) if node[0] > 0 else None
+                stack.pop()
+            elif state == 0:
+                frame[3] = 1
+                stack.append([node[0], start, depth + 1, 0, None])
+            elif state == 1:
+                frame[3] = 2
+                frame[4] = result
+                if result is not None and result is not mixed:
+                    pending.append(frame)
+                stack.append([node[1], start | (1 << (127 - depth)), depth + 1, 0, None])
+            else:
+                stack.pop()
+                right = result
+                if left is None or right is None:
+                    # At most one entry; keep it as is.
+                    result = right if left is None else left
+                elif left is not mixed and right is not mixed and left[2] == right[2]:
+                    # Two entries with the same ASN; collapse them.
+                    result = (start, depth, left[2])
+                else:
+                    # Different ASNs; yield all held back entries in order, then right.
+                    for held in pending:
+                        yield held[4]
+                        held[4] = mixed
+                    pending.clear()
+                    if right is not mixed:
+                        yield right
+                    result = mixed
+                if pending and pending[-1] is frame:
+                    pending.pop()
+        if result is not None and result is not mixed:
+            yield result
+
+    def iter_entries(self, fill: bool = False,
+                     as_int: bool = False) -> Iterator[Union[ASNEntry, IntASNEntry]]:
+        """
+        Generate the mappings in this ASMap object as non-overlapping entries, like
+        to_entries(overlapping=False, fill=fill), but lazily and with bounded memory.
+
+        Arguments:
+            fill:   Permit the resulting entries to cover subnets that are unassigned
+                    in this ASMap object.
+            as_int: Produce prefixes as (network address, prefix length) pairs, with
+                    the network address as a 128-bit integer, rather than as lists of
+                    bools.
+        """
+        if not fill and not as_int:
+            # Maintain the prefix as a list while walking the trie, which is cheaper than
+            # converting every entry's network address.
+            prefix: list[bool] = []
+            stack = [(self._trie, 0, False)]
+            while stack:
+                node, depth, bit = stack.pop()
+                if depth:
+                    del prefix[depth - 1:]
+                    prefix.append(bit)
+                if len(node) == 1:
+                    if node[0] > 0:
+                        yield list(prefix), node[0]
+                else:
+                    stack.append((node[1], depth + 1, True))
+                    stack.append((node[0], depth + 1, False))
+            return
+        for start, length, asn in self._iter_flat(fill):
+            if as_int:
+                yield (start, length), asn
+            else:
+                yield _int_to_prefix(start, length), asn
+
+    def _to_entries_flat(self, fill: bool = False) -> list[ASNEntry]:
+        """Convert an ASMap object to a list of non-overlapping (prefix, asn) objects."""
+        return list(self.iter_entries(fill))
 
     def _to_entries_minimal(self, fill: bool = False) -> list[ASNEntry]:
         """Convert a trie to a minimal list of ASNEntry objects, exploiting overlap."""
@@ -471,22 +1002,40 @@ class ASMap:
         ret._set_trie(trie)
         return ret
 
-    def _to_binnode(self, fill: bool = False) -> _BinNode:
-        """Convert a trie to a _BinNode object."""
-        def recurse(node: list) -> tuple[dict[Optional[int], _BinNode], bool]:
+    def _to_binnode(self, fill: bool = False, keep_cache: bool = False) -> _BinNode:
+        """
+        Convert a trie to a _BinNode object.
+
+        Results cached in self._encodings are reused. If keep_cache is set, the results for
+        inner nodes at every _ENCODING_CACHE_STRIDE'th depth are added to it, so after
+        updates only the changed paths (and the nodes below them up to the next cached
+        depth) need to be converted again.
+        """
+        kept = self._encodings
+        encodings = kept if keep_cache else {}
+
+        def recurse(node: list, depth: int) -> tuple[dict[Optional[int], _BinNode], bool]:
             if len(node) == 1 and node[0] == 0:
                 return {(None if fill else 0): _BinNode.make_end()}, True
             if len(node) == 1:
                 return {None: _BinNode.make_leaf(node[0]), node[0]: _BinNode.make_end()}, False
+            cache_key = id(node) * 2 + fill
+            checkpoint = depth % self._ENCODING_CACHE_STRIDE == 0
+            if checkpoint:
+                cached = kept.get(cache_key)
+                if cached is not None:
+                    return cached
             ret: dict[Optional[int], _BinNode] = {}
-            left, lhole = recurse(node[0])
-            right, rhole = recurse(node[1])
+            left, lhole = recurse(node[0], depth + 1)
+            right, rhole = recurse(node[1], depth + 1)
             hole = (lhole or rhole) and not fill
 
             def candidate(ctx: Optional[int], arg1, arg2, func: Callable):
                 if arg1 is not None and arg2 is not None:
-                    cand = func(arg1, arg2)
-                    if ctx not in ret or cand.size < ret[ctx].size:
+                    # Only construct the candidate if it is smaller than the best so far.
+                    best = ret.get(ctx)
+                    cand = func(arg1, arg2, None if best is None else best.size)
+                    if cand is not None:
                         ret[ctx] = cand
 
             union = set(left) | set(right)
@@ -503,141 +1052,221 @@ class ASMap:
                        if ctx is None or enc.size < ret[None].size}
             if hole:
                 ret = {ctx:enc for ctx, enc in ret.items() if ctx is None or ctx == 0}
+            if checkpoint and keep_cache:
+                for enc in ret.values():
+                    enc.cache_bits = True
+                encodings[cache_key] = (ret, hole)
             return ret, hole
-        res, _ = recurse(self._trie)
+        res, _ = recurse(self._trie, 0)
         return res[0] if 0 in res else res[None]
 
-    @staticmethod
-    def _from_binnode(binnode: _BinNode) -> "ASMap":
-        """Construct an ASMap object from a _BinNode. Internal use only."""
-        def recurse(node: _BinNode, default: int) -> list:
-            if node.ins == _Instruction.RETURN:
-                return [node.arg1]
-            if node.ins == _Instruction.JUMP:
-                return [recurse(node.arg1, default), recurse(node.arg2, default)]
-            if node.ins == _Instruction.MATCH:
-                val = node.arg1
-                sub = recurse(node.arg2, default)
-                while val >= 2:
-                    bit = val & 1
-                    val >>= 1
-                    if bit:
-                        sub = [[default], sub]
-                    else:
-                        sub = [sub, [default]]
-                return sub
-            assert node.ins == _Instruction.DEFAULT
-            return recurse(node.arg2, node.arg1)
-        ret = ASMap()
-        if binnode.ins != _Instruction.END:
-            #pylint: disable=protected-access
-            ret._set_trie(recurse(binnode, 0))
-        return ret
-
-    def to_binary(self, fill: bool = False) -> bytes:
+    def to_binary(self, fill: bool = False, keep_cache: bool = False) -> bytes:
         """
         Convert this ASMap object to binary.
 
-        Argument:
+        Arguments:
             fill: permit the resulting binary encoder to contain mappers for
                   unassigned subnets in this ASMap object. Doing so may
                   reduce the size of the encoding.
+            keep_cache: keep the encodings of subtrees in this object, so that
+                  calling to_binary again after updates only re-encodes the
+                  changed parts. This takes several times the memory of the
+                  trie itself (over 250 MB for a full map), until
+                  clear_encoding_cache() is called.
         Returns:
             A bytes object with the encoding of this ASMap object.
         """
-        bits: list[int] = []
-
-        def recurse(node: _BinNode) -> None:
-            _CODER_INS.encode(node.ins.value, bits)
-            if node.ins == _Instruction.RETURN:
-                _CODER_ASN.encode(node.arg1, bits)
-            elif node.ins == _Instruction.JUMP:
-                _CODER_JUMP.encode(node.arg1.size, bits)
-                recurse(node.arg1)
-                recurse(node.arg2)
-            elif node.ins == _Instruction.DEFAULT:
-                _CODER_ASN.encode(node.arg1, bits)
-                recurse(node.arg2)
+        def recurse(node: _BinNode) -> int:
+            """Return the encoding of node, as an integer of node.size bits."""
+            if node.bits is not None:
+                return node.bits
+            ins = node.ins
+            if ins is _Instruction.RETURN:
+                code = [_BinNode._RETURN_CODE, _CODER_ASN.encode_bits(node.arg1)]
+            elif ins is _Instruction.JUMP:
+                code = [_BinNode._JUMP_CODE, _CODER_JUMP.encode_bits(node.arg1.size),
+                        (recurse(node.arg1), node.arg1.size), (recurse(node.arg2), node.arg2.size)]
+            elif ins is _Instruction.DEFAULT:
+                code = [_BinNode._DEFAULT_CODE, _CODER_ASN.encode_bits(node.arg1),
+                        (recurse(node.arg2), node.arg2.size)]
             else:
-                assert node.ins == _Instruction.MATCH
-                _CODER_MATCH.encode(node.arg1, bits)
-                recurse(node.arg2)
-
-        binnode = self._to_binnode(fill)
-        if binnode.ins != _Instruction.END:
-            recurse(binnode)
-
-        val = 0
-        nbits = 0
-        ret = []
-        for bit in bits:
-            val += (bit << nbits)
-            nbits += 1
-            if nbits == 8:
-                ret.append(val)
-                val = 0
-                nbits = 0
-        if nbits:
-            ret.append(val)
-        return bytes(ret)
+                assert ins is _Instruction.MATCH
+                code = [_BinNode._MATCH_CODE, _CODER_MATCH.encode_bits(node.arg1),
+                        (recurse(node.arg2), node.arg2.size)]
+            ret = 0
+            for val, nbits in code:
+                ret = (ret << nbits) | val
+            if node.cache_bits:
+                node.bits = ret
+            return ret
+
+        binnode = self._to_binnode(fill, keep_cache)
+        if binnode.ins == _Instruction.END:
+            return b''
+        # Pad to a multiple of 8 bits, and convert to bytes. The asmap format starts at
+        # the least significant bit of every byte, so the bits in every byte are reversed.
+        nbytes = (binnode.size + 7) // 8
+        ret = recurse(binnode) << (nbytes * 8 - binnode.size)
+        return ret.to_bytes(nbytes, 'big').translate(_REVERSE_BITS)
+
+    def clear_encoding_cache(self) -> None:
+        """Release the encodings kept by to_binary(keep_cache=True)."""
+        self._encodings = {}
 
     @staticmethod
-    def from_binary(bindata: bytes) -> Optional["ASMap"]:
-        """Decode an ASMap object from the provided binary encoding."""
-
-        bits: list[int] = []
-        for byte in bindata:
-            bits.extend((byte >> i) & 1 for i in range(8))
-
-        def recurse(bitpos: int) -> tuple[_BinNode, int]:
-            insval, bitpos = _CODER_INS.decode(bits, bitpos)
-            ins = _Instruction(insval)
-            if ins == _Instruction.RETURN:
-                asn, bitpos = _CODER_ASN.decode(bits, bitpos)
-                return _BinNode(ins, asn), bitpos
-            if ins == _Instruction.JUMP:
-                jump, bitpos = _CODER_JUMP.decode(bits, bitpos)
-                left, bitpos1 = recurse(bitpos)
+    def from_binary(bindata: bytes, intern: bool = False) -> Optional["ASMap"]:
+        """
+        Decode an ASMap object from the provided binary encoding.
+
+        If intern is set, the result is in interning mode (see __init__), and identical
+        subtrees are shared as they are decoded.
+        """
+        stream = _BitStream(bindata)
+        data = stream.data
+        ins_return = _Instruction.RETURN.value
+        ins_jump = _Instruction.JUMP.value
+        ins_match = _Instruction.MATCH.value
+        ret = ASMap(intern=intern)
+        #pylint: disable=protected-access
+        make_leaf = ret._make_leaf
+        # Map from (id(node0) << 64) | id(node1) to the inner node with those children, if
+        # interning. The children are interned nodes, which are kept alive.
+        branches: Optional[dict[int, list]] = {} if intern else None
+
+        def branch(node0: list, node1: list) -> list:
+            if len(node0) == 1 and len(node1) == 1 and node0[0] == node1[0]:
+                return node0
+            if branches is None:
+                return [node0, node1]
+            key = (id(node0) << 64) | id(node1)
+            node = branches.get(key)
+            if node is None:
+                node = branches[key] = [node0, node1]
+            return node
+
+        def recurse(bitpos: int, default: int) -> tuple[list, int]:
+            insval, bitpos = _CODER_INS.decode(data, bitpos)
+            if insval == ins_return:
+                asn, bitpos = _CODER_ASN.decode(data, bitpos)
+                return make_leaf(asn), bitpos
+            if insval == ins_jump:
+                jump, bitpos = _CODER_JUMP.decode(data, bitpos)
+                left, bitpos1 = recurse(bitpos, default)
                 if bitpos1 != bitpos + jump:
                     raise ValueError("Inconsistent jump")
-                right, bitpos = recurse(bitpos1)
-                return _BinNode(ins, left, right), bitpos
-            if ins == _Instruction.MATCH:
-                match, bitpos = _CODER_MATCH.decode(bits, bitpos)
-                sub, bitpos = recurse(bitpos)
-                return _BinNode(ins, match, sub), bitpos
-            assert ins == _Instruction.DEFAULT
-            asn, bitpos = _CODER_ASN.decode(bits, bitpos)
-            sub, bitpos = recurse(bitpos)
-            return _BinNode(ins, asn, sub), bitpos
-
-        if len(bits) == 0:
-            binnode = _BinNode(_Instruction.END)
-        else:
-            try:
-                binnode, bitpos = recurse(0)
-            except (ValueError, IndexError):
-                return None
-            if bitpos < len(bits) - 7:
-                return None
-            if not all(bit == 0 for bit in bits[bitpos:]):
-                return None
+                right, bitpos = recurse(bitpos1, default)
+                return branch(left, right), bitpos
+            if insval == ins_match:
+                match, bitpos = _CODER_MATCH.decode(data, bitpos)
+                sub, bitpos = recurse(bitpos, default)
+                while match >= 2:
+                    if match & 1:
+                        sub = branch(make_leaf(default), sub)
+                    else:
+                        sub = branch(sub, make_leaf(default))
+                    match >>= 1
+                return sub, bitpos
+            asn, bitpos = _CODER_ASN.decode(data, bitpos)
+            return recurse(bitpos, asn)
+
+        if stream.nbits == 0:
+            return ret
+        try:
+            trie, bitpos = recurse(0, 0)
+        except ValueError:
+            return None
+        if bitpos > stream.nbits or bitpos < stream.nbits - 7:
+            return None
+        if not stream.is_zero(bitpos):
+            return None
+        ret._trie = trie
+        return ret
+
+    def _fingerprint(self, node: list) -> bytes:
+        """
+        Compute the fingerprint of a node of this object's trie: a hash of its structure
+        (a Merkle hash over its subtree). Structurally identical tries have the same
+        fingerprint, regardless of which ASMap object they belong to.
 
-        return ASMap._from_binnode(binnode)
+        Fingerprints of inner nodes are cached in self._fingerprints, keyed by id(node).
+        This is only safe because every cached node is part of self._trie: update()
+        removes the entries for all nodes it replaces (see _forget).
+        """
+        if len(node) == 1:
+            return hashlib.blake2b(b'L' + node[0].to_bytes(4, 'little'), digest_size=16).digest()
+        ret = self._fingerprints.get(id(node))
+        if ret is None:
+            ret = hashlib.blake2b(b'N' + self._fingerprint(node[0]) + self._fingerprint(node[1]),
+                                  digest_size=16).digest()
+            self._fingerprints[id(node)] = ret
+        return ret
+
+    def _forget(self, node: list, subtree: bool = False) -> None:
+        """
+        Remove the data cached (fingerprints and encodings) for an inner node that is
+        being removed from the trie or modified, or, if subtree is set, for all inner nodes
+        below it.
+
+        All per-node caches are keyed by id(node) without keeping the node alive, so
+        this must be called for every node removed from the trie or modified in place.
+        """
+        seen: set[int] = set()
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if len(node) == 2 and id(node) not in seen:
+                seen.add(id(node))
+                self._fingerprints.pop(id(node), None)
+                self._encodings.pop(id(node) * 2, None)
+                self._encodings.pop(id(node) * 2 + 1, None)
+                if subtree:
+                    stack.append(node[0])
+                    stack.append(node[1])
+
+    def fingerprint(self) -> bytes:
+        """
+        Return the fingerprint of this ASMap object: a hash such that ASMap objects are
+        equal if and only if their fingerprints are (barring hash collisions).
+
+        Computing it the first time takes a traversal of the trie. The result (and the
+        fingerprint of every subtree) is cached, and after updates only the fingerprints
+        of changed subtrees need to be recomputed. Once both objects have computed
+        fingerprints, comparisons, diff() and extends() use them to skip identical
+        subtrees; they do not compute them by themselves, as a single traversal without
+        them is cheaper.
+        """
+        return self._fingerprint(self._trie)
+
+    def _has_fingerprint(self) -> bool:
+        """Determine whether the fingerprint of this object is cached."""
+        return len(self._trie) == 1 or id(self._trie) in self._fingerprints
 
     def __lt__(self, other: "ASMap") -> bool:
+        if self._trie is other._trie:
+            return False
         return self._trie < other._trie
 
     def __eq__(self, other: object) -> bool:
         if isinstance(other, ASMap):
+            if self._trie is other._trie:
+                return True
+            #pylint: disable=protected-access
+            if self._has_fingerprint() and other._has_fingerprint():
+                return self.fingerprint() == other.fingerprint()
             return self._trie == other._trie
         return False
 
     def extends(self, req: "ASMap") -> bool:
         """Determine whether this matches req for all subranges where req is assigned."""
+        #pylint: disable=protected-access
+        use_fingerprints = self._has_fingerprint() and req._has_fingerprint()
+
         def recurse(actual: list, require: list) -> bool:
             if len(require) == 1 and require[0] == 0:
                 return True
+            if actual is require or (use_fingerprints and len(actual) == 2 and len(require) == 2
+                                     and self._fingerprint(actual) == req._fingerprint(require)):
+                return True
             if len(require) == 1:
                 if len(actual) == 1:
                     return bool(require[0] == actual[0])
@@ -646,45 +1275,718 @@ class ASMap:
                 return recurse(actual[0], require[0]) and recurse(actual[1], require[1])
             return recurse(actual, require[0]) and recurse(actual, require[1])
         assert isinstance(req, ASMap)
-        #pylint: disable=protected-access
         return recurse(self._trie, req._trie)
 
-    def diff(self, other: "ASMap") -> list[ASNDiff]:
-        """Compute the diff from self to other."""
-        prefix: list[bool] = []
-        ret: list[ASNDiff] = []
+    def overlay(self, other: "ASMap",
+                resolve: Optional[Callable[[int, int], int]] = None) -> "ASMap":
+        """
+        Construct a new ASMap object that combines self with other laid over it.
 
-        def recurse(old_node: list, new_node: list):
-            if len(old_node) == 1 and len(new_node) == 1:
-                if old_node[0] != new_node[0]:
-                    ret.append((list(prefix), old_node[0], new_node[0]))
-            else:
-                old_left: list = old_node if len(old_node) == 1 else old_node[0]
-                old_right: list = old_node if len(old_node) == 1 else old_node[1]
-                new_left: list = new_node if len(new_node) == 1 else new_node[0]
-                new_right: list = new_node if len(new_node) == 1 else new_node[1]
-                prefix.append(False)
-                recurse(old_left, new_left)
-                prefix[-1] = True
-                recurse(old_right, new_right)
-                prefix.pop()
+        For every range, resolve(asn in self, asn in other) determines the resulting ASN
+        (either may be 0 for unassigned). By default, other takes precedence wherever it
+        is assigned. Both tries are walked once, and subtrees not affected by other are
+        shared with self rather than copied.
+        """
         assert isinstance(other, ASMap)
+        ret = ASMap(intern=self._leaves is not None)
+        # Map from (id(base) << 64) | id(over) to the result for that pair of nodes, so that
+        # shared subtrees are only combined once.
+        memo: dict[int, list] = {}
+
+        def combine(base_asn: int, over_asn: int) -> int:
+            if resolve is None:
+                return over_asn or base_asn
+            asn = resolve(base_asn, over_asn)
+            assert asn == 0 or _CODER_ASN.can_encode(asn)
+            return asn
+
+        def recurse(base: list, over: list) -> list:
+            if resolve is None and len(over) == 1:
+                # Shortcut for the default policy: other is either transparent or wins.
+                return base if over[0] == 0 else over
+            key = (id(base) << 64) | id(over)
+            ret_node = memo.get(key)
+            if ret_node is not None:
+                return ret_node
+            if len(base) == 1 and len(over) == 1:
+                asn = combine(base[0], over[0])
+                if asn == base[0]:
+                    ret_node = base
+                elif asn == over[0]:
+                    ret_node = over
+                else:
+                    ret_node = ret._make_leaf(asn)
+            else:
+                base0, base1 = (base, base) if len(base) == 1 else base
+                over0, over1 = (over, over) if len(over) == 1 else over
+                node0, node1 = recurse(base0, over0), recurse(base1, over1)
+                if len(node0) == 1 and len(node1) == 1 and node0[0] == node1[0]:
+                    ret_node = node0
+                elif node0 is base0 and node1 is base1 and len(base) == 2:
+                    ret_node = base
+                else:
+                    ret_node = [node0, node1]
+            memo[key] = ret_node
+            return ret_node
+
         #pylint: disable=protected-access
-        recurse(self._trie, other._trie)
+        trie = recurse(self._trie, other._trie)
+        if ret._leaves is not None:
+            trie = ret._intern(trie)
+        ret._trie = trie
+        # The result shares subtrees with both operands.
+        self._shared = other._shared = ret._shared = True
         return ret
 
+    def iter_diff(self, other: "ASMap",
+                  as_int: bool = False) -> Iterator[Union[ASNDiff, IntASNDiff]]:
+        """
+        Generate the diff from self to other lazily, in the same order as diff().
+
+        If as_int is set, prefixes are produced as (network address, prefix length)
+        pairs, with the network address as a 128-bit integer.
+        """
+        assert isinstance(other, ASMap)
+        #pylint: disable=protected-access
+        use_fingerprints = self._has_fingerprint() and other._has_fingerprint()
+        stack = [(self._trie, other._trie, 0, 0)]
+        while stack:
+            old_node, new_node, start, depth = stack.pop()
+            if old_node is new_node:
+                # Identical subtrees; nothing to report.
+                continue
+            if len(old_node) == 2:
+                if len(new_node) == 2:
+                    if use_fingerprints and \
+                            self._fingerprint(old_node) == other._fingerprint(new_node):
+                        continue
+                    new_left, new_right = new_node
+                else:
+                    new_left = new_right = new_node
+                old_left, old_right = old_node
+            elif len(new_node) == 2:
+                old_left = old_right = old_node
+                new_left, new_right = new_node
+            else:
+                if old_node[0] != new_node[0]:
+                    if as_int:
+                        yield (start, depth), old_node[0], new_node[0]
+                    else:
+                        yield _int_to_prefix(start, depth), old_node[0], new_node[0]
+                continue
+            depth += 1
+            stack.append((old_right, new_right, start | (1 << (128 - depth)), depth))
+            stack.append((old_left, new_left, start, depth))
+
+    def diff(self, other: "ASMap") -> list[ASNDiff]:
+        """Compute the diff from self to other."""
+        return list(self.iter_diff(other))
+
     def __copy__(self) -> "ASMap":
-        """Construct a copy of this ASMap object. Its state will not be shared."""
+        """
+        Construct a copy of this ASMap object. Modifications to either object will not
+        affect the other. The trie nodes are shared, so from then on both objects replace
+        nodes rather than modifying them in place.
+        """
         ret = ASMap()
         #pylint: disable=protected-access
-        ret._set_trie(copy.deepcopy(self._trie))
+        ret._leaves = self._leaves
+        self._shared = ret._shared = True
+        ret._trie = self._trie
+        ret._fingerprints = dict(self._fingerprints)
+        ret._encodings = dict(self._encodings)
         return ret
 
     def __deepcopy__(self, _) -> "ASMap":
-        # ASMap objects do not allow sharing of the _trie member, so we don't need the memoization.
+        # Shared tries are never modified in place, so a shallow copy suffices.
         return self.__copy__()
 
 
+class CompiledASMap:
+    """
+    A read-only compiled form of an ASMap trie, optimized for lookups.
+
+    The trie is stored in a flat array of 32-bit integers, with two entries (for the
+    0 and 1 child) per inner node. Each entry is either the index of another inner
+    node, or a leaf ASN with _LEAF_FLAG set. Objects are constructed using
+    ASMap.compile().
+
+    Optionally, IPv4 lookups are accelerated with DIR-24-8 style tables: a table with an
+    entry for every /24, and a 256-entry block for every /24 that is not mapped as a
+    whole. Entries of the first table are either leaf ASNs with _LEAF_FLAG set, or the
+    index of a block; blocks only contain leaf ASNs. Every IPv4 lookup then takes at
+    most two array reads, at the cost of 64 MiB for the first table (plus 1 KiB per
+    block).
+    """
+
+    # Flag marking array entries that are leaf ASNs rather than node indices.
+    _LEAF_FLAG = 0x80000000
+
+    def __init__(self, trie: list, ipv4_table: bool = False) -> None:
+        """Construct a CompiledASMap object from an ASMap trie. Internal use only."""
+        #pylint: disable=protected-access
+        assert _CODER_ASN._maxval < self._LEAF_FLAG
+        self._nodes = array.array('I')
+        self._tbl24: Optional[array.array] = None
+        self._blocks: Optional[array.array] = None
+        if len(trie) == 1:
+            self._root = self._root_v4 = trie[0] | self._LEAF_FLAG
+            if ipv4_table:
+                self._build_ipv4_table()
+            return
+        self._root = 0
+        # Assign indices in breadth-first order; queue holds the inner nodes to emit.
+        queue = collections.deque([trie])
+        nodes = self._nodes
+        count = 1
+        while queue:
+            node = queue.popleft()
+            for child in node:
+                if len(child) == 1:
+                    nodes.append(child[0] | self._LEAF_FLAG)
+                else:
+                    nodes.append(count)
+                    count += 1
+                    queue.append(child)
+        # Remember where the IPv4-mapped range (::ffff:0:0/96) starts, so IPv4 lookups
+        # can skip the first 96 steps.
+        self._root_v4 = self._root
+        for bit in range(127, 31, -1):
+            if self._root_v4 & self._LEAF_FLAG:
+                break
+            self._root_v4 = nodes[2 * self._root_v4 + ((0xffff00000000 >> bit) & 1)]
+        if ipv4_table:
+            self._build_ipv4_table()
+
+    def _build_ipv4_table(self) -> None:
+        """Construct the DIR-24-8 tables for IPv4 lookups from the compiled trie."""
+        nodes = self._nodes
+        leaf_flag = self._LEAF_FLAG
+        tbl24 = array.array('I', bytes(4 << 24))
+        blocks = array.array('I')
+        # Stack entries are (node reference, first IPv4 address, prefix length).
+        stack = [(self._root_v4, 0, 0)]
+        while stack:
+            ref, start, depth = stack.pop()
+            if ref & leaf_flag:
+                if depth <= 24:
+                    count = 1 << (24 - depth)
+                    tbl24[start >> 8:(start >> 8) + count] = array.array('I', [ref]) * count
+                else:
+                    # Within a block; tbl24 holds its index for this /24.
+                    offset = (tbl24[start >> 8] << 8) | (start & 0xff)
+                    count = 1 << (32 - depth)
+                    blocks[offset:offset + count] = array.array('I', [ref]) * count
+                continue
+            if depth == 24:
+                tbl24[start >> 8] = len(blocks) >> 8
+                blocks.extend(bytes(4 << 8))
+            stack.append((nodes[2 * ref + 1], start | (1 << (31 - depth)), depth + 1))
+            stack.append((nodes[2 * ref], start, depth + 1))
+        self._tbl24 = tbl24
+        self._blocks = blocks
+
+    def memory_usage(self) -> dict[str, int]:
+        """
+        Report on the memory used by the compiled tables, in bytes. Returns a dictionary
+        with:
+        - nodes_bytes: the compiled trie
+        - ipv4_table_bytes: the IPv4 lookup tables (0 if not enabled)
+        - ipv4_blocks: the number of 256-entry blocks in the IPv4 lookup tables
+        """
+        ret = {'nodes_bytes': len(self._nodes) * self._nodes.itemsize,
+               'ipv4_table_bytes': 0, 'ipv4_blocks': 0}
+        if self._tbl24 is not None and self._blocks is not None:
+            ret['ipv4_table_bytes'] = (len(self._tbl24) * self._tbl24.itemsize +
+                                       len(self._blocks) * self._blocks.itemsize)
+            ret['ipv4_blocks'] = len(self._blocks) >> 8
+        return ret
+
+    def lookup_int(self, addr: int, is_v4: bool) -> int:
+        """
+        Look up a single address, given as an integer: a 32-bit IPv4 or a 128-bit IPv6
+        address. Returns ASN, or 0 if unassigned.
+        """
+        nodes = self._nodes
+        leaf_flag = self._LEAF_FLAG
+        if is_v4 and self._tbl24 is not None:
+            ref = self._tbl24[addr >> 8]
+            if ref < leaf_flag:
+                ref = self._blocks[(ref << 8) | (addr & 0xff)] # type: ignore[index]
+            return ref - leaf_flag
+        if is_v4:
+            ref = self._root_v4
+            bit = 31
+        else:
+            ref = self._root
+            bit = 127
+        while ref < leaf_flag:
+            ref = nodes[2 * ref + ((addr >> bit) & 1)]
+            bit -= 1
+        return ref - leaf_flag
+
+    def lookup(self, prefix: list[bool]) -> Optional[int]:
+        """Look up a prefix. Returns ASN, or 0 if unassigned, or None if indeterminate."""
+        nodes = self._nodes
+        ref = self._root
+        for bit in prefix:
+            if ref & self._LEAF_FLAG:
+                break
+            ref = nodes[2 * ref + bit]
+        if ref & self._LEAF_FLAG:
+            return ref & ~self._LEAF_FLAG
+        return None
+
+    def __len__(self) -> int:
+        """Return the number of inner nodes in the compiled trie."""
+        return len(self._nodes) // 2
+
+
+class IntervalASMap:
+    """
+    A read-only form of an ASMap as a sorted table of address ranges, optimized for
+    fast loading and lookups through binary search.
+
+    Every entry consists of a 128-bit start address and an ASN (0 if unassigned), and
+    maps all addresses from its start up to the start of the next entry. The first
+    entry starts at address 0, and consecutive entries have different ASNs.
+
+    The table is stored in a fixed-width binary format, which is used as is, without
+    parsing:
+    - 8 bytes: the magic string b"ASMAPIV1"
+    - 8 bytes: the number of entries n, as a little-endian integer
+    - n times 16 bytes: the start addresses, each as two little-endian 64-bit integers
+      (high and low half)
+    - n times 4 bytes: the ASNs, as little-endian 32-bit integers
+    """
+
+    _MAGIC = b"ASMAPIV1"
+    _HEADER_SIZE = 16
+    # Names of the shared memory blocks created by to_shared_memory() in this process.
+    _created: set[str] = set()
+
+    def __init__(self, buf) -> None:
+        """Construct an IntervalASMap object from a buffer containing the binary format."""
+        view = memoryview(buf).cast('B')
+        if len(view) < self._HEADER_SIZE or bytes(view[0:8]) != self._MAGIC:
+            raise ValueError("Not an interval asmap")
+        count = int.from_bytes(view[8:16], 'little')
+        if count == 0 or len(view) != self._HEADER_SIZE + 20 * count:
+            raise ValueError("Inconsistent interval asmap size")
+        self._buf = buf
+        self._count = count
+        starts = view[self._HEADER_SIZE:self._HEADER_SIZE + 16 * count]
+        asns = view[self._HEADER_SIZE + 16 * count:]
+        if sys.byteorder == 'little':
+            starts, asns = starts.cast('Q'), asns.cast('I')
+        else:
+            starts, asns = array.array('Q', starts), array.array('I', asns)
+            starts.byteswap()
+            asns.byteswap()
+        self._starts_hi = starts[0::2]
+        self._starts_lo = starts[1::2]
+        self._asns = asns
+        self._np_tables: Optional[dict] = None
+        self._file = None
+
+    @staticmethod
+    def from_intervals(intervals: list[tuple[int, int]]) -> "IntervalASMap":
+        """Construct an IntervalASMap object from a sorted list of (start, asn) pairs."""
+        starts = array.array('Q')
+        asns = array.array('I')
+        for start, asn in intervals:
+            starts.append(start >> 64)
+            starts.append(start & 0xffffffffffffffff)
+            asns.append(asn)
+        if sys.byteorder != 'little':
+            starts.byteswap()
+            asns.byteswap()
+        return IntervalASMap(IntervalASMap._MAGIC + len(asns).to_bytes(8, 'little') +
+                             starts.tobytes() + asns.tobytes())
+
+    @staticmethod
+    def from_file(path) -> "IntervalASMap":
+        """Construct an IntervalASMap object by memory-mapping a file in the binary format."""
+        with open(path, 'rb') as file:
+            data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            ret = IntervalASMap(data)
+        except ValueError:
+            data.close()
+            raise
+        ret._file = data
+        return ret
+
+    @staticmethod
+    def from_shared_memory(name: str) -> "IntervalASMap":
+        """
+        Construct an IntervalASMap object by attaching to a shared memory block, created by
+        to_shared_memory() in this or another process, without copying it.
+
+        Before Python 3.13, multiprocessing workers that attach should be started by the
+        process that created the block, as they share its resource tracker.
+        """
+        try:
+            shm = shared_memory.SharedMemory(name=name, track=False) # type: ignore[call-arg]
+        except TypeError:
+            # Before Python 3.13, attached blocks are always registered with the resource
+            # tracker, which unlinks them when the process exits. Undo that, unless the
+            # tracker is the one of the creating process (this process or its parent), where
+            # the registration belongs to the creator.
+            shm = shared_memory.SharedMemory(name=name)
+            if multiprocessing.parent_process() is None and name not in IntervalASMap._created:
+                #pylint: disable=protected-access
+                resource_tracker.unregister(shm._name, "shared_memory") # type: ignore[attr-defined]
+        # The block may be larger than requested (rounded up to whole pages).
+        count = int.from_bytes(shm.buf[8:16], 'little')
+        try:
+            ret = IntervalASMap(shm.buf[:IntervalASMap._HEADER_SIZE + 20 * count])
+        except ValueError:
+            shm.close()
+            raise
+        ret._file = shm
+        return ret
+
+    def to_shared_memory(self, name: Optional[str] = None) -> shared_memory.SharedMemory:
+        """
+        Copy the binary format of this table into a new shared memory block, which other
+        processes can attach to using from_shared_memory(block.name). The caller owns the
+        block, and should close() and unlink() it when it is no longer needed.
+        """
+        shm = shared_memory.SharedMemory(name=name, create=True, size=len(self._buf))
+        shm.buf[:len(self._buf)] = self._buf
+        IntervalASMap._created.add(shm.name)
+        return shm
+
+    def to_bytes(self) -> bytes:
+        """Return the binary format of this table."""
+        return bytes(self._buf)
+
+    def save(self, path) -> None:
+        """Write the binary format of this table to a file."""
+        with open(path, 'wb') as file:
+            file.write(self._buf)
+
+    def close(self) -> None:
+        """
+        Release the memory-mapped file or shared memory block, if any. The object cannot be
+        used afterwards.
+        """
+        self._starts_hi = self._starts_lo = self._asns = memoryview(b'')
+        self._np_tables = None
+        if self._file is not None:
+            self._buf = b''
+            self._file.close()
+            self._file = None
+
+    def __enter__(self) -> "IntervalASMap":
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        """Return the number of entries in the table."""
+        return self._count
+
+    def intervals(self) -> list[tuple[int, int]]:
+        """Return the table as a list of (start, asn) pairs."""
+        return [((hi << 64) | lo, asn)
+                for hi, lo, asn in zip(self._starts_hi, self._starts_lo, self._asns)]
+
+    def _find(self, addr: int) -> int:
+        """Find the index of the entry containing 128-bit address addr."""
+        addr_hi, addr_lo = addr >> 64, addr & 0xffffffffffffffff
+        # Find the entries whose start has the same high half, and then search those by
+        # their low half.
+        end = bisect.bisect_right(self._starts_hi, addr_hi)
+        begin = bisect.bisect_left(self._starts_hi, addr_hi, 0, end)
+        return bisect.bisect_right(self._starts_lo, addr_lo, begin, end) - 1
+
+    def lookup_int(self, addr: int, is_v4: bool) -> int:
+        """
+        Look up a single address, given as an integer: a 32-bit IPv4 or a 128-bit IPv6
+        address. Returns ASN, or 0 if unassigned.
+        """
+        if is_v4:
+            addr |= 0xffff00000000
+        return self._asns[self._find(addr)]
+
+    def lookup_covering(self, addr: int) -> tuple[int, int]:
+        """
+        Look up a 128-bit address. Returns its ASN (0 if unassigned), and the length of the
+        shortest prefix of addr that is mapped to that ASN as a whole.
+        """
+        idx = self._find(addr)
+        first = (self._starts_hi[idx] << 64) | self._starts_lo[idx]
+        if idx + 1 < self._count:
+            last = ((self._starts_hi[idx + 1] << 64) | self._starts_lo[idx + 1]) - 1
+        else:
+            last = (1 << 128) - 1
+        # Binary search for the largest number of host bits whose range stays in the entry.
+        low, high = 0, 128
+        while low < high:
+            bits = (low + high + 1) // 2
+            mask = (1 << bits) - 1
+            if addr & ~mask >= first and addr | mask <= last:
+                low = bits
+            else:
+                high = bits - 1
+        return self._asns[idx], 128 - low
+
+    def lookup(self, prefix: list[bool]) -> Optional[int]:
+        """Look up a prefix. Returns ASN, or 0 if unassigned, or None if indeterminate."""
+        assert len(prefix) <= 128
+        first = sum(bit << (127 - i) for i, bit in enumerate(prefix))
+        last = first | ((1 << (128 - len(prefix))) - 1)
+        idx = self._find(first)
+        if idx + 1 < self._count and self._find(last) != idx:
+            return None
+        return self._asns[idx]
+
+    def lookup_many(self, addrs):
+        """
+        Look up many addresses at once, using NumPy.
+
+        Argument:
+            addrs: either a 1-dimensional array of IPv4 addresses as uint32 values, or
+                   an (n, 2) array of IPv6 addresses as (high, low) pairs of uint64
+                   values.
+        Returns:
+            A uint32 NumPy array with the ASN (or 0 if unassigned) of every address.
+        """
+        #pylint: disable=import-outside-toplevel
+        import numpy as np
+
+        addr6_dtype = np.dtype([('hi', '<u8'), ('lo', '<u8')])
+        if self._np_tables is None:
+            # IPv6 table: the starts as (high, low) structured values, which sort like
+            # the 128-bit addresses. These are views on the buffer.
+            v6_starts = np.frombuffer(self._buf, dtype=addr6_dtype, count=self._count,
+                                      offset=self._HEADER_SIZE)
+            v6_asns = np.frombuffer(self._buf, dtype='<u4', count=self._count,
+                                    offset=self._HEADER_SIZE + 16 * self._count)
+            # IPv4 table: the entries overlapping ::ffff:0:0/96, relative to its start.
+            v4_start = 0xffff00000000
+            v4_range = np.array([(0, v4_start), (0, v4_start + (1 << 32))], dtype=addr6_dtype)
+            first = np.searchsorted(v6_starts, v4_range[0], side='right') - 1
+            last = np.searchsorted(v6_starts, v4_range[1], side='left')
+            v4_starts = v6_starts['lo'][first:last] - np.uint64(v4_start)
+            v4_starts[0] = 0
+            self._np_tables = {
+                4: (v4_starts.astype(np.uint32), v6_asns[first:last]),
+                6: (v6_starts, v6_asns),
+            }
+
+        addrs = np.asarray(addrs)
+        if addrs.ndim == 1:
+            starts, asns = self._np_tables[4]
+            keys = addrs.astype(np.uint32, copy=False)
+        elif addrs.ndim == 2 and addrs.shape[1] == 2:
+            starts, asns = self._np_tables[6]
+            keys = np.empty(len(addrs), dtype=addr6_dtype)
+            keys['hi'] = addrs[:, 0]
+            keys['lo'] = addrs[:, 1]
+        else:
+            raise ValueError("addrs must have shape (n,) or (n, 2)")
+        return asns[np.searchsorted(starts, keys, side='right') - 1].astype(np.uint32)
+
+
+class ASMapLookupCache:
+    """
+    A bounded LRU cache for address lookups in an ASMap or IntervalASMap object.
+
+    Results are cached per covering prefix (see lookup_covering), so a cached result
+    applies exactly to all addresses in that prefix, and lookups for nearby addresses
+    (e.g. from the same /24) hit the cache. The underlying map must not be modified while
+    the cache is in use.
+    """
+
+    def __init__(self, asmap: Union["ASMap", "IntervalASMap"], maxsize: int = 65536) -> None:
+        """Construct a cache holding up to maxsize prefixes in front of asmap."""
+        assert maxsize >= 1
+        self._asmap = asmap
+        self._maxsize = maxsize
+        # Map from (covering prefix << 8) | prefix length to ASN, in LRU order.
+        self._cache: collections.OrderedDict[int, int] = collections.OrderedDict()
+        # Number of cache hits per prefix length, and the prefix lengths in the order to
+        # probe them (most hits first).
+        self._depth_hits: dict[int, int] = {}
+        self._depths: list[int] = []
+        self.hits = 0
+        self.misses = 0
+
+    def lookup_int(self, addr: int, is_v4: bool) -> int:
+        """
+        Look up a single address, given as an integer: a 32-bit IPv4 or a 128-bit IPv6
+        address. Returns ASN, or 0 if unassigned.
+        """
+        if is_v4:
+            addr |= 0xffff00000000
+        cache = self._cache
+        for depth in self._depths:
+            key = ((addr >> (128 - depth)) << 8) | depth
+            asn = cache.get(key)
+            if asn is not None:
+                cache.move_to_end(key)
+                self._depth_hits[depth] += 1
+                self.hits += 1
+                return asn
+        self.misses += 1
+        asn, depth = self._asmap.lookup_covering(addr)
+        cache[((addr >> (128 - depth)) << 8) | depth] = asn
+        if len(cache) > self._maxsize:
+            cache.popitem(last=False)
+        if depth not in self._depth_hits:
+            self._depth_hits[depth] = 0
+        # Keep the probe order up to date; this is cheap compared to the lookup itself.
+        self._depths = sorted(self._depth_hits, key=self._depth_hits.__getitem__, reverse=True)
+        return asn
+
+    def __len__(self) -> int:
+        """Return the number of cached prefixes."""
+        return len(self._cache)
+
+
+class MappedASMap:
+    """
+    A read-only ASMap that answers lookups by directly interpreting the binary asmap
+    format, like the interpreter in the node software does.
+
+    No trie is constructed: every lookup walks the instructions in the encoding,
+    skipping over the subprograms it does not need using JUMP offsets. When
+    constructed with from_file, the data is memory-mapped, so loading is instant and
+    the pages can be shared with other processes that map the same file.
+
+    The data is not validated up front; malformed encodings raise ValueError during
+    lookups that run into the problem.
+    """
+
+    def __init__(self, bindata) -> None:
+        """Construct a MappedASMap object from a buffer with binary asmap data."""
+        self._data = bindata
+        self._nbits = len(bindata) * 8
+        self._file = None
+
+    @staticmethod
+    def from_file(path) -> "MappedASMap":
+        """Construct a MappedASMap object by memory-mapping an asmap file."""
+        #pylint: disable=consider-using-with
+        file = open(path, 'rb')
+        try:
+            data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files cannot be mapped.
+            data = b''
+        ret = MappedASMap(data)
+        ret._file = file
+        return ret
+
+    def close(self) -> None:
+        """Release the memory-mapped file, if any."""
+        if self._file is not None:
+            if isinstance(self._data, mmap.mmap):
+                self._data.close()
+            self._file.close()
+            self._file = None
+        self._data = b''
+        self._nbits = 0
+
+    def __enter__(self) -> "MappedASMap":
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def lookup(self, prefix: list[bool]) -> Optional[int]:
+        """Look up a prefix. Returns ASN, or 0 if unassigned, or None if indeterminate."""
+        data = self._data
+        nbits = self._nbits
+        if nbits == 0:
+            return 0
+        ins_return = _Instruction.RETURN.value
+        ins_jump = _Instruction.JUMP.value
+        ins_match = _Instruction.MATCH.value
+        bitpos = 0
+        offset = 0
+        default = 0
+        while True:
+            start = bitpos
+            ins, bitpos = _CODER_INS.decode(data, bitpos, True)
+            if ins == ins_return:
+                asn, bitpos = _CODER_ASN.decode(data, bitpos, True)
+                if bitpos > nbits:
+                    raise ValueError("Truncated asmap")
+                return asn
+            if ins == ins_jump:
+                jump, bitpos = _CODER_JUMP.decode(data, bitpos, True)
+                if offset == len(prefix):
+                    # The prefix ends here; the result is determinate only if every
+                    # path through the rest of the program gives the same ASN.
+                    return self._single_result(start, default, set())
+                if prefix[offset]:
+                    bitpos += jump
+                offset += 1
+            elif ins == ins_match:
+                match, bitpos = _CODER_MATCH.decode(data, bitpos, True)
+                for bit in range(match.bit_length() - 2, -1, -1):
+                    if offset == len(prefix):
+                        # Either the rest of the match fails, or the program continues.
+                        return self._single_result(bitpos, default, {default})
+                    if prefix[offset] != ((match >> bit) & 1):
+                        return default
+                    offset += 1
+            else:
+                default, bitpos = _CODER_ASN.decode(data, bitpos, True)
+            if bitpos >= nbits:
+                raise ValueError("Truncated asmap")
+
+    def _single_result(self, bitpos: int, default: int, results: set[int]) -> Optional[int]:
+        """
+        Return the ASN that the program starting at bitpos (with the given default) gives
+        for every address, together with the ones already in results, or None if there
+        are several.
+        """
+        if not self._collect_results(bitpos, default, results) or len(results) != 1:
+            return None
+        return next(iter(results))
+
+    def _collect_results(self, bitpos: int, default: int, results: set[int]) -> bool:
+        """
+        Add the ASNs that the program starting at bitpos can give to results. Returns
+        False as soon as there are two of them.
+        """
+        data = self._data
+        nbits = self._nbits
+        while True:
+            ins, bitpos = _CODER_INS.decode(data, bitpos, True)
+            if ins == _Instruction.RETURN.value:
+                asn, bitpos = _CODER_ASN.decode(data, bitpos, True)
+                if bitpos > nbits:
+                    raise ValueError("Truncated asmap")
+                results.add(asn)
+                return len(results) < 2
+            if ins == _Instruction.JUMP.value:
+                jump, bitpos = _CODER_JUMP.decode(data, bitpos, True)
+                if not self._collect_results(bitpos + jump, default, results):
+                    return False
+            elif ins == _Instruction.MATCH.value:
+                _, bitpos = _CODER_MATCH.decode(data, bitpos, True)
+                # Addresses that do not match get the default.
+                results.add(default)
+                if len(results) > 1:
+                    return False
+            else:
+                default, bitpos = _CODER_ASN.decode(data, bitpos, True)
+            if bitpos >= nbits:
+                raise ValueError("Truncated asmap")
+
+
+def _lookup_shared(name: str, addrs: list[int]) -> list[int]:
+    """Look up 128-bit addresses in a shared IntervalASMap (used by test_shared_memory)."""
+    with IntervalASMap.from_shared_memory(name) as table:
+        return [table.lookup_int(addr, False) for addr in addrs]
+
 class TestASMap(unittest.TestCase):
     """Unit tests for this module."""
 
@@ -814,5 +2116,331 @@ class TestASMap(unittest.TestCase):
                                 # And such a patch must exist.
                                 self.assertTrue(found)
 
+    def test_mapped_lookups(self) -> None:
+        """Test that MappedASMap lookups match those of the decoded ASMap object."""
+        for leaves in range(1, 40):
+            for pct in range(0, 101, 5):
+                asmap = ASMap.from_random(num_leaves=leaves, max_asn=1000,
+                                          unassigned_prob=0.01 * pct)
+                for fill in [False, True]:
+                    enc = asmap.to_binary(fill=fill)
+                    decoded = ASMap.from_binary(enc)
+                    assert decoded is not None
+                    mapped = MappedASMap(enc)
+                    for _ in range(20):
+                        prefix = [random.getrandbits(1) != 0 for _ in range(random.randrange(12))]
+                        self.assertEqual(mapped.lookup(prefix), decoded.lookup(prefix))
+        # A non-canonical encoding, whose two branches both return ASN 1.
+        enc = bytes.fromhex('070098000000')
+        self.assertEqual(ASMap.from_binary(enc), ASMap([([], 1)]))
+        self.assertEqual(MappedASMap(enc).lookup([]), 1)
+        self.assertEqual(MappedASMap(enc).lookup([True]), 1)
+
+    def test_interning(self) -> None:
+        """Test that interning mode shares subtrees without affecting behavior."""
+        for leaves in range(1, 40):
+            asmap = ASMap.from_random(num_leaves=leaves, max_asn=4, unassigned_prob=0.2)
+            enc = asmap.to_binary()
+            interned = ASMap.from_binary(enc, intern=True)
+            assert interned is not None
+            self.assertEqual(interned, asmap)
+            entries = asmap.to_entries(overlapping=False)
+            self.assertEqual(ASMap(entries, intern=True), asmap)
+            usage = interned.memory_usage()
+            self.assertEqual(usage['nodes'], asmap.memory_usage()['nodes'])
+            # Leaves with equal ASN (and thus also equal subtrees) must be shared.
+            self.assertLessEqual(usage['unique_nodes'],
+                                 len(set(asn for _, asn in entries)) + 1 + leaves - 1)
+            # Updates must not affect copies, even though nodes are shared.
+            copied = copy.copy(interned)
+            for _ in range(5):
+                prefix = [random.getrandbits(1) != 0 for _ in range(random.randrange(8))]
+                newasn = random.randrange(5)
+                interned.update(prefix, newasn)
+                asmap.update(prefix, newasn)
+                self.assertEqual(interned, asmap)
+            self.assertEqual(ASMap.from_binary(enc), copied)
+
+    def test_fingerprints(self) -> None:
+        """Test that fingerprints track equality through updates."""
+        for leaves in range(1, 40):
+            asmap = ASMap.from_random(num_leaves=leaves, max_asn=4, unassigned_prob=0.2)
+            rebuilt = ASMap(asmap.to_entries(), intern=True)
+            self.assertEqual(asmap.fingerprint(), rebuilt.fingerprint())
+            for _ in range(10):
+                prefix = [random.getrandbits(1) != 0 for _ in range(random.randrange(8))]
+                newasn = random.randrange(5)
+                rebuilt.update(prefix, newasn)
+                self.assertEqual(asmap.fingerprint() == rebuilt.fingerprint(),
+                                 asmap.diff(rebuilt) == [])
+                self.assertEqual(rebuilt.fingerprint(),
+                                 ASMap(rebuilt.to_entries()).fingerprint())
+
+    def test_incremental_encoding(self) -> None:
+        """Test that to_binary after updates matches the encoding of a fresh object."""
+        for leaves in range(1, 100, 3):
+            asmap = ASMap.from_random(num_leaves=leaves, max_asn=4, unassigned_prob=0.2)
+            for _ in range(5):
+                for fill in [False, True]:
+                    fresh = ASMap(asmap.to_entries())
+                    self.assertEqual(asmap.to_binary(fill=fill, keep_cache=True),
+                                     fresh.to_binary(fill=fill))
+                prefix = [random.getrandbits(1) != 0 for _ in range(random.randrange(20))]
+                asmap.update(prefix, random.randrange(5))
+            self.assertEqual(asmap.to_binary(), ASMap(asmap.to_entries()).to_binary())
+            asmap.clear_encoding_cache()
+            self.assertEqual(asmap.to_binary(), ASMap(asmap.to_entries()).to_binary())
+            self.assertEqual(asmap._encodings, {}) #pylint: disable=protected-access
+
+    def test_streaming_entries(self) -> None:
+        """Test that iter_entries and iter_diff agree with the list-based functions."""
+        for leaves in range(1, 40):
+            asmap = ASMap.from_random(num_leaves=leaves, max_asn=4, unassigned_prob=0.3)
+            other = ASMap.from_random(num_leaves=leaves, max_asn=4, unassigned_prob=0.3)
+            for fill in [False, True]:
+                entries = list(asmap.iter_entries(fill=fill))
+                int_entries = list(asmap.iter_entries(fill=fill, as_int=True))
+                self.assertEqual(len(entries), len(int_entries))
+                for (prefix, asn), ((start, length), int_asn) in zip(entries, int_entries):
+                    self.assertEqual(len(prefix), length)
+                    self.assertEqual(asn, int_asn)
+                    self.assertEqual(prefix, _int_to_prefix(start, length))
+                    if not fill:
+                        self.assertEqual(asmap.lookup(prefix), asn)
+                # Filled entries must agree with the map wherever it is assigned.
+                self.assertTrue(ASMap(entries).extends(asmap) if fill else
+                                ASMap(entries) == asmap)
+            diff = list(asmap.iter_diff(other, as_int=True))
+            self.assertEqual([(_int_to_prefix(*prefix), old, new) for prefix, old, new in diff],
+                             asmap.diff(other))
+
+    def test_parallel_construction(self) -> None:
+        """Test that from_entries builds the same trie as the constructor."""
+        #pylint: disable=protected-access
+        for leaves in range(1, 60):
+            asmap = ASMap.from_random(num_leaves=leaves, max_asn=5, unassigned_prob=0.3)
+            entries = asmap.to_entries()
+            # Add conflicting entries for existing prefixes.
+            entries += [(prefix, random.randrange(6)) for prefix, _ in entries[:2]]
+            expected = ASMap(entries)
+            for shard_size in [1, 3, 1000]:
+                built = ASMap.from_entries(entries, jobs=1, shard_size=shard_size)
+                self.assertEqual(built._trie, expected._trie)
+        asmap = ASMap.from_random(num_leaves=200, max_asn=5, unassigned_prob=0.3)
+        entries = asmap.to_entries()
+        built = ASMap.from_entries(entries, jobs=2, intern=True)
+        self.assertEqual(built._trie, ASMap(entries)._trie)
+        self.assertEqual(built.memory_usage()['unique_nodes'],
+                         ASMap(entries, intern=True).memory_usage()['unique_nodes'])
+
+    def test_ordering(self) -> None:
+        """Test that all comparison operators are consistent with the order of the tries."""
+        #pylint: disable=protected-access
+        # Maps of the same shape, so that their tries can be compared.
+        maps = [ASMap([([False], asn0), ([True], asn1)])
+                for asn0 in range(1, 4) for asn1 in range(1, 4) if asn0 != asn1]
+        for left in maps:
+            for right in maps:
+                self.assertEqual(left < right, left._trie < right._trie)
+                self.assertEqual(left <= right, left._trie <= right._trie)
+                self.assertEqual(left > right, left._trie > right._trie)
+                self.assertEqual(left >= right, left._trie >= right._trie)
+        self.assertEqual(sorted(maps, reverse=True), maps[::-1])
+
+    def test_lookup_cache(self) -> None:
+        """Test covering prefix lookups, and that cached lookups match uncached ones."""
+        for leaves in range(1, 40):
+            asmap = ASMap.from_random(num_leaves=leaves, max_asn=5, unassigned_prob=0.3)
+            interval_map = asmap.to_interval_map()
+            caches = [ASMapLookupCache(asmap, maxsize=4), ASMapLookupCache(interval_map)]
+            for _ in range(50):
+                if random.getrandbits(1):
+                    addr, is_v4 = random.getrandbits(32), True
+                    prefix = net_to_prefix(ipaddress.IPv4Network(addr))
+                else:
+                    addr, is_v4 = random.getrandbits(128), False
+                    prefix = net_to_prefix(ipaddress.IPv6Network(addr))
+                addr128 = addr | 0xffff00000000 if is_v4 else addr
+                asn, length = asmap.lookup_covering(addr128)
+                self.assertEqual(interval_map.lookup_covering(addr128), (asn, length))
+                self.assertEqual(asmap.lookup(prefix), asn)
+                # The covering prefix is mapped as a whole, but its parent is not.
+                self.assertEqual(asmap.lookup(prefix[:length]), asn)
+                if length > 0:
+                    self.assertIsNone(asmap.lookup(prefix[:length - 1]))
+                for cache in caches:
+                    self.assertEqual(cache.lookup_int(addr, is_v4), asn)
+                    self.assertEqual(cache.lookup_int(addr, is_v4), asn)
+            for cache in caches:
+                self.assertGreaterEqual(cache.hits, 50)
+                self.assertEqual(cache.hits + cache.misses, 100)
+
+    def test_lookup_range(self) -> None:
+        """Test that lookup_range matches the flat entries within the queried prefix."""
+        for leaves in range(1, 40):
+            asmap = ASMap.from_random(num_leaves=leaves, max_asn=5, unassigned_prob=0.3)
+            entries = asmap.to_entries(overlapping=False)
+            for _ in range(20):
+                prefix = [random.getrandbits(1) != 0 for _ in range(random.randrange(10))]
+                expected = []
+                for entry, asn in entries:
+                    if entry[:len(prefix)] == prefix:
+                        expected.append((entry, asn))
+                    elif prefix[:len(entry)] == entry:
+                        expected.append((prefix, asn))
+                self.assertEqual(asmap.lookup_range(prefix), expected)
+
+    def test_lookup_asn(self) -> None:
+        """Test that lookup_asn matches the entries, also after updates."""
+        for leaves in range(1, 40):
+            asmap = ASMap.from_random(num_leaves=leaves, max_asn=5, unassigned_prob=0.3)
+            for _ in range(3):
+                entries = asmap.to_entries(overlapping=False)
+                for asn in range(1, 7):
+                    self.assertEqual(asmap.lookup_asn(asn),
+                                     [prefix for prefix, entry_asn in entries if entry_asn == asn])
+                prefix = [random.getrandbits(1) != 0 for _ in range(random.randrange(8))]
+                asmap.update(prefix, random.randrange(7))
+
+    def test_overlay(self) -> None:
+        """Test overlay against update_multi and point lookups."""
+        for leaves in range(1, 40):
+            base = ASMap.from_random(num_leaves=leaves, max_asn=5, unassigned_prob=0.3)
+            over = ASMap.from_random(num_leaves=leaves, max_asn=5, unassigned_prob=0.7)
+            expected = copy.copy(base)
+            expected.update_multi(over.to_entries(overlapping=False))
+            self.assertEqual(base.overlay(over), expected)
+            self.assertIs(base.overlay(ASMap())._trie, base._trie) #pylint: disable=protected-access
+            merged = base.overlay(over, resolve=min)
+            for _ in range(20):
+                addr = random.getrandbits(128)
+                self.assertEqual(merged.lookup_covering(addr)[0],
+                                 min(base.lookup_covering(addr)[0], over.lookup_covering(addr)[0]))
+            # The result is normalized like any other trie.
+            self.assertEqual(merged._trie, ASMap(merged.to_entries())._trie) #pylint: disable=protected-access
+            # The result shares nodes with both operands, so updating them must not affect it.
+            merged_entries = merged.to_entries()
+            for asmap in (base, over):
+                for _ in range(5):
+                    prefix = [random.getrandbits(1) != 0 for _ in range(random.randrange(8))]
+                    asmap.update(prefix, random.randrange(6))
+            self.assertEqual(merged.to_entries(), merged_entries)
+
+    def test_compiled_lookups(self) -> None:
+        """Test that CompiledASMap lookups match those of the ASMap object."""
+        for leaves in range(1, 40):
+            for pct in range(0, 101, 5):
+                asmap = ASMap.from_random(num_leaves=leaves, max_asn=1000,
+                                          unassigned_prob=0.01 * pct)
+                compiled = asmap.compile()
+                for _ in range(20):
+                    prefix = [random.getrandbits(1) != 0 for _ in range(random.randrange(12))]
+                    self.assertEqual(compiled.lookup(prefix), asmap.lookup(prefix))
+                    addr = random.getrandbits(128)
+                    net = ipaddress.IPv6Network(addr)
+                    self.assertEqual(compiled.lookup_int(addr, False),
+                                     asmap.lookup(net_to_prefix(net)))
+                    addr = random.getrandbits(32)
+                    net4 = ipaddress.IPv4Network(addr)
+                    self.assertEqual(compiled.lookup_int(addr, True),
+                                     asmap.lookup(net_to_prefix(net4)))
+
+    def test_ipv4_table(self) -> None:
+        """Test that lookups through the IPv4 table match those of the ASMap object."""
+        for num_entries in [0, 10, 200]:
+            entries = []
+            for _ in range(num_entries):
+                length = random.randrange(33)
+                addr = random.getrandbits(32) >> (32 - length) << (32 - length)
+                entries.append((net_to_prefix(ipaddress.IPv4Network((addr, length))),
+                                random.randrange(1000)))
+            asmap = ASMap(entries)
+            compiled = asmap.compile(ipv4_table=True)
+            usage = compiled.memory_usage()
+            self.assertEqual(usage['ipv4_table_bytes'], 4 * (1 << 24) + 1024 * usage['ipv4_blocks'])
+            addrs = [random.getrandbits(32) for _ in range(200)]
+            # Also look up addresses at the edges of every entry.
+            for prefix, _ in entries:
+                net = prefix_to_net(prefix)
+                addrs += [int(net.network_address), int(net.broadcast_address)]
+            for addr in addrs:
+                self.assertEqual(compiled.lookup_int(addr, True),
+                                 asmap.lookup(net_to_prefix(ipaddress.IPv4Network(addr))))
+            addr = random.getrandbits(128)
+            self.assertEqual(compiled.lookup_int(addr, False),
+                             asmap.lookup(net_to_prefix(ipaddress.IPv6Network(addr))))
+
+    def test_interval_map(self) -> None:
+        """Test that IntervalASMap objects roundtrip through bytes and match ASMap lookups."""
+        for leaves in range(1, 40):
+            for pct in range(0, 101, 5):
+                asmap = ASMap.from_random(num_leaves=leaves, max_asn=1000,
+                                          unassigned_prob=0.01 * pct)
+                intervals = asmap.to_interval_map()
+                loaded = IntervalASMap(intervals.to_bytes())
+                self.assertEqual(loaded.intervals(), intervals.intervals())
+                for prefix, asn in asmap.to_entries(overlapping=False):
+                    self.assertEqual(loaded.lookup(prefix), asn)
+                for _ in range(20):
+                    prefix = [random.getrandbits(1) != 0 for _ in range(random.randrange(12))]
+                    self.assertEqual(loaded.lookup(prefix), asmap.lookup(prefix))
+                    addr = random.getrandbits(128)
+                    net = ipaddress.IPv6Network(addr)
+                    self.assertEqual(loaded.lookup_int(addr, False),
+                                     asmap.lookup(net_to_prefix(net)))
+
+    def test_shared_memory(self) -> None:
+        """Test that IntervalASMap objects can be shared between processes."""
+        asmap = ASMap.from_random(num_leaves=100, max_asn=1000, unassigned_prob=0.2)
+        block = asmap.to_interval_map().to_shared_memory()
+        try:
+            addrs = [random.getrandbits(128) for _ in range(100)]
+            expected = [asmap.lookup_int(addr, False) for addr in addrs]
+            with IntervalASMap.from_shared_memory(block.name) as attached:
+                self.assertEqual([attached.lookup_int(addr, False) for addr in addrs], expected)
+            with concurrent.futures.ProcessPoolExecutor(max_workers=2) as executor:
+                results = executor.map(_lookup_shared, [block.name] * 4, [addrs] * 4)
+                self.assertEqual(list(results), [expected] * 4)
+            # An unrelated process attaching and exiting must not unlink the block.
+            script = (f"import asmap; print(asmap._lookup_shared({block.name!r}, {addrs!r}))")
+            for _ in range(2):
+                child = subprocess.run([sys.executable, '-c', script], capture_output=True,
+                                       check=True, text=True,
+                                       cwd=os.path.dirname(os.path.abspath(__file__)))
+                self.assertEqual(child.stdout, f"{expected}\n")
+                self.assertNotIn("leaked", child.stderr)
+            with IntervalASMap.from_shared_memory(block.name) as attached:
+                self.assertEqual([attached.lookup_int(addr, False) for addr in addrs], expected)
+        finally:
+            block.close()
+            block.unlink()
+
+    def test_lookup_many(self) -> None:
+        """Test that lookup_many matches lookup for IPv4 and IPv6 addresses."""
+        try:
+            #pylint: disable=import-outside-toplevel
+            import numpy as np
+        except ImportError:
+            self.skipTest("NumPy is not available")
+        for leaves in range(1, 40):
+            asmap = ASMap.from_random(num_leaves=leaves, max_asn=1000, unassigned_prob=0.3)
+            # Make sure the IPv4-mapped range is not trivially covered by a single leaf.
+            for _ in range(5):
+                prefix = net_to_prefix(ipaddress.IPv4Network('0.0.0.0/0'))
+                prefix += [random.getrandbits(1) != 0 for _ in range(random.randrange(12))]
+                asmap.update(prefix, random.randrange(1000))
+            addrs4 = [random.getrandbits(32) for _ in range(100)]
+            addrs6 = [random.getrandbits(128) for _ in range(100)]
+            addrs6 += [0xffff00000000 + addr for addr in addrs4]
+            res4 = asmap.lookup_many(np.array(addrs4, dtype=np.uint32))
+            res6 = asmap.lookup_many(np.array([(addr >> 64, addr & 0xffffffffffffffff)
+                                               for addr in addrs6], dtype=np.uint64))
+            for addr, asn in zip(addrs4, res4):
+                prefix = net_to_prefix(ipaddress.IPv4Network(addr))
+                self.assertEqual(asmap.lookup(prefix), asn)
+            for addr, asn in zip(addrs6, res6):
+                prefix = net_to_prefix(ipaddress.IPv6Network(addr))
+                self.assertEqual(asmap.lookup(prefix), asn)
+
 if __name__ == '__main__':
     unittest.main()
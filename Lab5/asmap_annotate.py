@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# Copyright (c) 2013-2022 The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+#
+# Annotate a stream of IP addresses with their ASN
+#
+
+import argparse
+import itertools
+import socket
+import sys
+import time
+from typing import Optional
+
+from asmap import ASMap, IntervalASMap
+
+DEFAULT_CHUNK_SIZE = 65536
+
+def load_map(path: str) -> IntervalASMap:
+    """ Load an asmap file, or memory-map an IntervalASMap file (such as one cached by makeseeds). """
+    with open(path, 'rb') as f:
+        magic = f.read(len(IntervalASMap._MAGIC)) #pylint: disable=protected-access
+    if magic == IntervalASMap._MAGIC: #pylint: disable=protected-access
+        return IntervalASMap.from_file(path)
+    with open(path, 'rb') as f:
+        asmap = ASMap.from_binary(f.read())
+    if asmap is None:
+        sys.exit(f'Invalid asmap file "{path}"')
+    return asmap.to_interval_map()
+
+def parse_address(line: str) -> Optional[tuple[str, bytes]]:
+    """ Parse a line holding an address, as `ip`, `ip:port` or `[ipv6]:port`, optionally
+    followed by whitespace or a `#` comment (as in nodes_main.txt).
+
+    Returns the address as written and the packed IP (4 or 16 bytes), or `None` if the line
+    cannot be parsed.
+    """
+    fields = line.split('#', 1)[0].split()
+    if not fields:
+        return None
+    token = fields[0]
+    if token.startswith('['):
+        host = token[1:token.find(']')]
+        family = socket.AF_INET6
+    elif token.count(':') == 1:
+        host = token.split(':', 1)[0]
+        family = socket.AF_INET
+    elif ':' in token:
+        host = token
+        family = socket.AF_INET6
+    else:
+        host = token
+        family = socket.AF_INET
+    try:
+        return token, socket.inet_pton(family, host)
+    except OSError:
+        return None
+
+def lookup_chunk(table: IntervalASMap, packed: list[bytes]) -> list[int]:
+    """ Look up a list of packed IPv4 and IPv6 addresses at once. """
+    try:
+        import numpy as np #pylint: disable=import-outside-toplevel
+    except ImportError:
+        return [table.lookup_int(int.from_bytes(ip, 'big'), len(ip) == 4) for ip in packed]
+
+    ret = np.zeros(len(packed), dtype=np.uint32)
+    is_v4 = np.fromiter((len(ip) == 4 for ip in packed), dtype=bool, count=len(packed))
+    if is_v4.any():
+        v4 = np.frombuffer(b''.join(ip for ip in packed if len(ip) == 4), dtype='>u4')
+        ret[is_v4] = table.lookup_many(v4)
+    if not is_v4.all():
+        v6 = np.frombuffer(b''.join(ip for ip in packed if len(ip) == 16), dtype='>u8')
+        ret[~is_v4] = table.lookup_many(v6.reshape(-1, 2))
+    return ret.tolist()
+
+def annotate(table: IntervalASMap, infile, outfile, chunk_size: int) -> tuple[int, int]:
+    """ Annotate every address read from `infile`, writing `address ASN` lines to `outfile`.
+    Lines are processed `chunk_size` at a time, so memory use does not grow with the input.
+
+    Returns the number of annotated addresses and of skipped lines.
+    """
+    annotated = skipped = 0
+    while True:
+        lines = list(itertools.islice(infile, chunk_size))
+        if not lines:
+            break
+        parsed = [parse_address(line) for line in lines]
+        addrs = [entry for entry in parsed if entry is not None]
+        skipped += len(lines) - len(addrs)
+        if not addrs:
+            continue
+        asns = lookup_chunk(table, [packed for _, packed in addrs])
+        outfile.write(''.join(f'{token} {asn}\n' for (token, _), asn in zip(addrs, asns)))
+        annotated += len(addrs)
+    return annotated, skipped
+
+def parse_args():
+    argparser = argparse.ArgumentParser(description='Annotate IP addresses (one per line, optionally with a port) with their ASN.')
+    argparser.add_argument("-a", "--asmap", help='the location of the asmap asn database file, or of an interval asmap file (required)', required=True)
+    argparser.add_argument("input", help='the file to read addresses from (default: stdin)', nargs='?')
+    argparser.add_argument("-c", "--chunk-size", help='the number of lines to process at once', default=DEFAULT_CHUNK_SIZE, type=int)
+    return argparser.parse_args()
+
+def main():
+    args = parse_args()
+
+    print(f'Loading asmap database "{args.asmap}"…', end='', file=sys.stderr, flush=True)
+    table = load_map(args.asmap)
+    print('Done.', file=sys.stderr)
+
+    start = time.perf_counter()
+    if args.input is None:
+        annotated, skipped = annotate(table, sys.stdin, sys.stdout, args.chunk_size)
+    else:
+        with open(args.input, 'r', encoding='utf8') as f:
+            annotated, skipped = annotate(table, f, sys.stdout, args.chunk_size)
+    elapsed = time.perf_counter() - start
+    print(f'Annotated {annotated} addresses ({skipped} lines skipped) in {elapsed:.2f}s, '
+          f'{(annotated + skipped) / max(elapsed, 1e-9):.0f} lines/s', file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# Copyright (c) 2013-2022 The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+#
+# Benchmark the asmap module against a real asmap file, and print the results as JSON
+#
+
+import argparse
+import copy
+import gc
+import ipaddress
+import json
+from pathlib import Path
+import platform
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+
+from asmap import ASMap, net_to_prefix
+
+DEFAULT_ASMAP = Path(__file__).parent / "asmap-filled.dat"
+
+BENCHMARKS = ['load', 'lookup', 'to_binary', 'to_entries', 'diff']
+
+def timed(func, repeat: int, setup=None) -> dict:
+    """
+    Run func repeat times and return timing statistics. If setup is given, it is called
+    (untimed) before every run and its result is passed to func.
+    """
+    times = []
+    for _ in range(repeat):
+        arg = setup() if setup is not None else None
+        gc.collect()
+        start = time.perf_counter()
+        if setup is not None:
+            func(arg)
+        else:
+            func()
+        times.append(time.perf_counter() - start)
+    return {'best_s': min(times), 'median_s': statistics.median(times), 'runs': repeat}
+
+def peak_memory(func) -> int:
+    """Return the peak number of bytes allocated on the Python heap while running func."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def random_prefixes(rng: random.Random, count: int, v4: bool) -> list[list[bool]]:
+    """Generate count random single-address prefixes."""
+    if v4:
+        return [net_to_prefix(ipaddress.IPv4Network(rng.getrandbits(32))) for _ in range(count)]
+    # Draw from 2000::/3, where nearly all routed IPv6 space is.
+    return [net_to_prefix(ipaddress.IPv6Network((1 << 125) | rng.getrandbits(125)))
+            for _ in range(count)]
+
+def derived_version(asmap: ASMap, updates: int, seed: int) -> ASMap:
+    """Return a copy of asmap with a number of random subnets reassigned."""
+    rng = random.Random(seed)
+    ret = copy.copy(asmap)
+    for i in range(updates):
+        v4 = i % 2 == 0
+        prefix = random_prefixes(rng, 1, v4)[0]
+        length = rng.randrange(96 + 8, 96 + 25) if v4 else rng.randrange(20, 49)
+        ret.update(prefix[:length], rng.randrange(1, 1 << 20))
+    return ret
+
+def bench_load(args, bindata: bytes, results: dict) -> None:
+    stats = timed(lambda: ASMap.from_binary(bindata), args.repeat)
+    stats['peak_bytes'] = peak_memory(lambda: ASMap.from_binary(bindata))
+    results['load'] = stats
+
+def bench_lookup(args, asmap: ASMap, results: dict) -> None:
+    rng = random.Random(args.seed)
+    for family, v4 in [('ipv4', True), ('ipv6', False)]:
+        prefixes = random_prefixes(rng, args.lookups, v4)
+        stats = timed(lambda prefixes=prefixes: [asmap.lookup(p) for p in prefixes], args.repeat)
+        stats['count'] = len(prefixes)
+        stats['per_s'] = len(prefixes) / stats['best_s']
+        results[f'lookup_{family}'] = stats
+
+def bench_to_binary(args, bindata: bytes, results: dict) -> None:
+    # Every run starts from a freshly loaded map, so no cached encodings are reused.
+    for fill in [False, True]:
+        stats = timed(lambda asmap, fill=fill: asmap.to_binary(fill=fill), args.repeat,
+                      setup=lambda: ASMap.from_binary(bindata))
+        results['to_binary_fill' if fill else 'to_binary'] = stats
+    # Re-encoding after a few updates only needs to redo the changed subtrees.
+    asmap = ASMap.from_binary(bindata)
+    asmap.to_binary(keep_cache=True)
+    rng = random.Random(args.seed)
+    def update_and_encode() -> None:
+        prefix = random_prefixes(rng, 1, True)[0][:96 + 24]
+        asmap.update(prefix, rng.randrange(1, 1 << 20))
+        asmap.to_binary(keep_cache=True)
+    results['to_binary_incremental'] = timed(update_and_encode, args.repeat)
+
+def bench_to_entries(args, asmap: ASMap, results: dict) -> None:
+    stats = timed(lambda: asmap.to_entries(overlapping=False), args.repeat)
+    stats['count'] = sum(1 for _ in asmap.iter_entries())
+    results['to_entries_flat'] = stats
+    def consume() -> None:
+        for _ in asmap.iter_entries():
+            pass
+    stats = timed(consume, args.repeat)
+    stats['peak_bytes'] = peak_memory(consume)
+    results['iter_entries'] = stats
+    stats = timed(asmap.to_entries, args.repeat)
+    stats['count'] = len(asmap.to_entries())
+    results['to_entries'] = stats
+
+def bench_diff(args, bindata: bytes, results: dict) -> None:
+    if args.other is not None:
+        with open(args.other, 'rb') as f:
+            other_data = f.read()
+        def setup() -> tuple[ASMap, ASMap]:
+            return ASMap.from_binary(bindata), ASMap.from_binary(other_data)
+    else:
+        def setup() -> tuple[ASMap, ASMap]:
+            asmap = ASMap.from_binary(bindata)
+            return asmap, derived_version(asmap, args.updates, args.seed)
+    # A cold diff walks both tries; a warm one uses fingerprints computed beforehand.
+    results['diff_cold'] = timed(lambda maps: maps[0].diff(maps[1]), args.repeat, setup=setup)
+    old, new = setup()
+    results['diff_cold']['count'] = len(old.diff(new))
+    old.fingerprint()
+    new.fingerprint()
+    results['diff_warm'] = timed(lambda: old.diff(new), args.repeat)
+
+def parse_args():
+    argparser = argparse.ArgumentParser(description='Benchmark the asmap module, printing the results as JSON.')
+    argparser.add_argument("-a", "--asmap", help=f'the asmap file to benchmark against (default: {DEFAULT_ASMAP.name})', default=DEFAULT_ASMAP)
+    argparser.add_argument("--other", help='a second version of the asmap file to diff against (default: a randomly updated copy)')
+    argparser.add_argument("-b", "--bench", help='the benchmarks to run (default: all)', nargs='+', choices=BENCHMARKS, default=BENCHMARKS)
+    argparser.add_argument("-r", "--repeat", help='the number of runs of each benchmark', default=3, type=int)
+    argparser.add_argument("-n", "--lookups", help='the number of random lookups per address family', default=100000, type=int)
+    argparser.add_argument("-u", "--updates", help='the number of random updates for the diffed copy', default=1000, type=int)
+    argparser.add_argument("--seed", help='the random seed', default=42, type=int)
+    argparser.add_argument("-o", "--output", help='write the results to this file rather than stdout')
+    return argparser.parse_args()
+
+def main():
+    args = parse_args()
+
+    with open(args.asmap, 'rb') as f:
+        bindata = f.read()
+    asmap = ASMap.from_binary(bindata)
+    if asmap is None:
+        sys.exit(f'Invalid asmap file "{args.asmap}"')
+
+    results = {
+        'asmap': str(args.asmap),
+        'asmap_bytes': len(bindata),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'seed': args.seed,
+        'benchmarks': {},
+    }
+    for name in args.bench:
+        print(f'Running {name} benchmark…', end='', file=sys.stderr, flush=True)
+        start = time.perf_counter()
+        if name == 'load':
+            bench_load(args, bindata, results['benchmarks'])
+        elif name == 'lookup':
+            bench_lookup(args, asmap, results['benchmarks'])
+        elif name == 'to_binary':
+            bench_to_binary(args, bindata, results['benchmarks'])
+        elif name == 'to_entries':
+            bench_to_entries(args, asmap, results['benchmarks'])
+        elif name == 'diff':
+            bench_diff(args, bindata, results['benchmarks'])
+        print(f'Done ({time.perf_counter() - start:.1f}s).', file=sys.stderr)
+
+    output = json.dumps(results, indent=2)
+    if args.output is not None:
+        with open(args.output, 'w', encoding='utf8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
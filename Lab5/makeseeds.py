@@ -8,16 +8,25 @@
 
 import argparse
 import collections
-import ipaddress
+import concurrent.futures
+import contextlib
+import hashlib
+import importlib.util
+import json
+import os
 from pathlib import Path
 import random
 import re
+import socket
 import sys
-from typing import Union
+import tempfile
+import time
+import unittest
+from typing import Callable, Iterable, Iterator, Optional, Union
 
 asmap_dir = Path(__file__).parent.parent / "asmap"
 sys.path.append(str(asmap_dir))
-from asmap import ASMap, net_to_prefix  # noqa: E402
+from asmap import ASMap, ASMapLookupCache, IntervalASMap  # noqa: E402
 
 NSEEDS=512
 
@@ -28,8 +37,17 @@ MAX_SEEDS_PER_ASN = {
 
 MIN_BLOCKS = 840000
 
-PATTERN_IPV4 = re.compile(r"^((\d{1,3})\.(\d{1,3})\.(\d{1,3})\.(\d{1,3})):(\d+)$")
-PATTERN_IPV6 = re.compile(r"^\[([0-9a-z:]+)\]:(\d+)$")
+# Require at least 50% 30-day uptime for clearnet, onion and i2p; 10% for cjdns
+REQ_UPTIME = {
+    'ipv4': 50,
+    'ipv6': 50,
+    'onion': 50,
+    'i2p': 50,
+    'cjdns': 10,
+}
+
+DEFAULT_ASMAP_CACHE = Path(os.environ.get('XDG_CACHE_HOME', Path.home() / '.cache')) / 'makeseeds'
+
 PATTERN_ONION = re.compile(r"^([a-z2-7]{56}\.onion):(\d+)$")
 PATTERN_I2P = re.compile(r"^([a-z2-7]{52}\.b32.i2p):(\d+)$")
 PATTERN_AGENT = re.compile(
@@ -51,6 +69,54 @@ PATTERN_AGENT = re.compile(
     r"28.(0|99).0|"
     r")")
 
+IPV6_CHARS = frozenset('0123456789abcdefghijklmnopqrstuvwxyz:')
+
+def parseaddress(addr: str) -> Optional[tuple[str, str, int, Optional[int]]]:
+    """ Parses an address with port, as found in the first column of `seeds_main.txt`.
+
+    Dispatches on the first character or the suffix of `addr`, so that only one kind of address
+    is tried. Returns (net, address, port, address as integer or `None` for onion and i2p), or
+    `None` if the address could not be parsed.
+    """
+    host, sep, portstr = addr.rpartition(':')
+    if not sep or not portstr.isdecimal():
+        return None
+    port = int(portstr)
+    if port > 0xffff:
+        return None
+    if host.startswith('['):
+        # IPv6 (or cjdns, which looks like IPv6 but always begins with fc).
+        if not host.endswith(']'):
+            return None
+        host = host[1:-1]
+        if not host or not IPV6_CHARS.issuperset(host):
+            return None
+        try:
+            ip = int.from_bytes(socket.inet_pton(socket.AF_INET6, host), 'big')
+        except OSError:
+            return None
+        if ip == 0: # Not interested in localhost
+            return None
+        return ('cjdns' if host.startswith('fc') else 'ipv6'), host, port, ip
+    if host.endswith('.onion'):
+        m = PATTERN_ONION.match(addr)
+        return None if m is None else ('onion', m.group(1), port, None)
+    if host.endswith('.i2p'):
+        m = PATTERN_I2P.match(addr)
+        return None if m is None else ('i2p', m.group(1), port, None)
+    # IPv4, with sanity check.
+    octets = host.split('.')
+    if len(octets) != 4:
+        return None
+    ip = 0
+    for octet in octets:
+        if not (0 < len(octet) <= 3 and octet.isdecimal()) or int(octet) > 255:
+            return None
+        ip = (ip << 8) + int(octet)
+    if ip == 0:
+        return None
+    return 'ipv4', host, port, ip
+
 def parseline(line: str) -> Union[dict, None]:
     """ Parses a line from `seeds_main.txt` into a dictionary of details for that line.
     or `None`, if the line could not be parsed.
@@ -65,47 +131,10 @@ def parseline(line: str) -> Union[dict, None]:
     # Skip bad results.
     if int(sline[1]) == 0:
         return None
-    m = PATTERN_IPV4.match(sline[0])
-    sortkey = None
-    ip = None
-    if m is None:
-        m = PATTERN_IPV6.match(sline[0])
-        if m is None:
-            m = PATTERN_ONION.match(sline[0])
-            if m is None:
-                m = PATTERN_I2P.match(sline[0])
-                if m is None:
-                    return None
-                else:
-                    net = 'i2p'
-                    ipstr = sortkey = m.group(1)
-                    port = int(m.group(2))
-            else:
-                net = 'onion'
-                ipstr = sortkey = m.group(1)
-                port = int(m.group(2))
-        else:
-            net = 'ipv6'
-            if m.group(1) in ['::']: # Not interested in localhost
-                return None
-            ipstr = m.group(1)
-            if ipstr.startswith("fc"): # cjdns looks like ipv6 but always begins with fc
-                net = "cjdns"
-            sortkey = ipstr # XXX parse IPv6 into number, could use name_to_ipv6 from generate-seeds
-            port = int(m.group(2))
-    else:
-        # Do IPv4 sanity check
-        ip = 0
-        for i in range(0,4):
-            if int(m.group(i+2)) < 0 or int(m.group(i+2)) > 255:
-                return None
-            ip = ip + (int(m.group(i+2)) << (8*(3-i)))
-        if ip == 0:
-            return None
-        net = 'ipv4'
-        sortkey = ip
-        ipstr = m.group(1)
-        port = int(m.group(6))
+    parsed = parseaddress(sline[0])
+    if parsed is None:
+        return None
+    net, ipstr, port, ip = parsed
     # Extract uptime %.
     uptime30 = float(sline[7][:-1])
     # Extract Unix timestamp of last success.
@@ -123,32 +152,189 @@ def parseline(line: str) -> Union[dict, None]:
         'net': net,
         'ip': ipstr,
         'port': port,
-        'ipnum': ip,
+        'ipnum': ip if net in ('ipv4', 'ipv6', 'cjdns') else None,
         'uptime': uptime30,
         'lastsuccess': lastsuccess,
         'version': version,
         'agent': agent,
         'service': service,
         'blocks': blocks,
-        'sortkey': sortkey,
+        'sortkey': ipstr if ip is None else ip,
     }
 
-def dedup(ips: list[dict]) -> list[dict]:
-    """ Remove duplicates from `ips` where multiple ips share address and port. """
-    d = {}
-    for ip in ips:
-        d[ip['ip'],ip['port']] = ip
-    return list(d.values())
+def record_filters(minblocks: int) -> list[tuple[str, str, Callable[[dict], bool]]]:
+    """ Return the filters that only look at a single entry, as (id, description, predicate)
+    tuples. The ids are short and stable, for machine-readable output.
+    """
+    return [
+        ('minblocks', 'Enforce minimal number of blocks', lambda ip: ip['blocks'] >= minblocks),
+        ('service', 'Require service bit 1', lambda ip: (ip['service'] & 1) == 1),
+        ('uptime', 'Require minimum uptime', lambda ip: ip['uptime'] > REQ_UPTIME[ip['net']]),
+        ('agent', 'Require a known and recent user agent', lambda ip: PATTERN_AGENT.match(ip['agent']) is not None),
+    ]
+
+def parse_and_filter(lines: Iterable[str], filters: list[tuple[str, str, Callable[[dict], bool]]]) -> tuple[int, collections.Counter, dict]:
+    """ Parse seeder lines, remove duplicates and apply `filters`, in a single streaming pass.
+
+    Of the entries that share address and port (in case multiple seeds files were
+    concatenated), the last one is kept, and the filters apply to that entry. Only entries
+    that pass all filters are kept in memory.
+
+    Returns the number of lines read, the number of valid entries per net, and a map from
+    (ip, port) to (net, number of filters passed, entry if all were passed) for the last entry
+    with that address and port.
+    """
+    latest: dict[tuple[str, int], tuple[str, int, Optional[dict]]] = {}
+    valid: collections.Counter = collections.Counter()
+    num_lines = 0
+    for line in lines:
+        num_lines += 1
+        ip = parseline(line)
+        if ip is None:
+            continue
+        valid[ip['net']] += 1
+        num_passed = 0
+        for _, _, predicate in filters:
+            if not predicate(ip):
+                break
+            num_passed += 1
+        key = (ip['ip'], ip['port'])
+        # Move the key to the end, so that the order does not depend on chunking.
+        latest.pop(key, None)
+        latest[key] = (ip['net'], num_passed, ip if num_passed == len(filters) else None)
+    return num_lines, valid, latest
+
+def parse_file_chunk(path: str, start: int, end: int, minblocks: int) -> tuple[int, collections.Counter, dict]:
+    """ Apply `parse_and_filter` to the lines of the file at `path` that start within the
+    byte range [`start`, `end`). This runs in worker processes.
+    """
+    def lines() -> Iterator[str]:
+        with open(path, 'rb') as f:
+            pos = start
+            if start > 0:
+                # Skip the line that started before this chunk.
+                f.seek(start - 1)
+                pos += len(f.readline()) - 1
+            while pos < end:
+                line = f.readline()
+                if not line:
+                    break
+                pos += len(line)
+                yield line.decode('utf8')
+    return parse_and_filter(lines(), record_filters(minblocks))
+
+def merge_parsed(chunks: Iterable[tuple[int, collections.Counter, dict]], num_filters: int) -> tuple[int, list[dict], list[collections.Counter]]:
+    """ Merge the results of `parse_and_filter` on consecutive chunks of the seeds, as if all
+    lines had been processed at once.
+
+    Returns the number of lines read, the entries that passed all filters, and the number of
+    entries per net after every stage: the valid entries, the entries after removing duplicates,
+    and after each filter.
+    """
+    latest: dict[tuple[str, int], tuple[str, int, Optional[dict]]] = {}
+    valid: collections.Counter = collections.Counter()
+    num_lines = 0
+    for chunk_lines, chunk_valid, chunk_latest in chunks:
+        num_lines += chunk_lines
+        valid.update(chunk_valid)
+        for key, entry in chunk_latest.items():
+            latest.pop(key, None)
+            latest[key] = entry
+    # passed[n] counts the deduplicated entries that pass the first n filters.
+    passed = [collections.Counter() for _ in range(num_filters + 1)]
+    ips = []
+    for net, num_passed, ip in latest.values():
+        for counts in passed[:num_passed + 1]:
+            counts[net] += 1
+        if ip is not None:
+            ips.append(ip)
+    return num_lines, ips, [valid] + passed
+
+def read_seeds(path: str, minblocks: int, jobs: int) -> tuple[int, list[dict], list[collections.Counter]]:
+    """ Read, parse and filter the seeds file at `path`, using `jobs` worker processes.
+
+    The file is split into byte ranges, which are processed in parallel and merged in order,
+    so the result does not depend on the number of jobs. See `merge_parsed` for the result.
+    """
+    num_filters = len(record_filters(minblocks))
+    if jobs <= 1:
+        with open(path, 'r', encoding='utf8') as f:
+            return merge_parsed([parse_and_filter(f, record_filters(minblocks))], num_filters)
+    size = os.path.getsize(path)
+    num_chunks = jobs * 4
+    bounds = [size * i // num_chunks for i in range(num_chunks + 1)]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        chunks = executor.map(parse_file_chunk, [path] * num_chunks, bounds[:-1], bounds[1:],
+                              [minblocks] * num_chunks)
+        return merge_parsed(chunks, num_filters)
 
 def filtermultiport(ips: list[dict]) -> list[dict]:
     """ Filter out hosts with more nodes per IP"""
     hist = collections.defaultdict(list)
     for ip in ips:
-        hist[ip['sortkey']].append(ip)
+        hist[ip['net'], ip['sortkey']].append(ip)
     return [value[0] for (key,value) in list(hist.items()) if len(value)==1]
 
+def load_asmap(path: str, cache_dir: Optional[Path]) -> Union[ASMap, IntervalASMap]:
+    """ Load the asmap file at `path` for lookups.
+
+    If `cache_dir` is given, the decoded map is cached there as an IntervalASMap file named
+    after the location and the SHA-256 of the asmap file, and memory-mapped from there on later
+    runs. Cache files for other versions of the asmap file at the same location are removed.
+    """
+    with open(path, 'rb') as f:
+        bindata = f.read()
+    if cache_dir is None:
+        return ASMap.from_binary(bindata)
+
+    location = hashlib.sha256(str(Path(path).resolve()).encode('utf8')).hexdigest()[:16]
+    cache_path = cache_dir / f'asmap-{location}-{hashlib.sha256(bindata).hexdigest()}.ivmap'
+    try:
+        return IntervalASMap.from_file(cache_path)
+    except (OSError, ValueError):
+        pass
+
+    asmap = ASMap.from_binary(bindata)
+    if asmap is None:
+        sys.exit(f'Invalid asmap file "{path}"')
+    table = asmap.to_interval_map()
+    tmp_path = None
+    try:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=cache_dir, suffix='.tmp', delete=False) as f:
+            tmp_path = f.name
+        table.save(tmp_path)
+        os.replace(tmp_path, cache_path)
+        for stale in cache_dir.glob(f'asmap-{location}-*.ivmap'):
+            if stale != cache_path:
+                stale.unlink()
+    except OSError as e:
+        print(f'Cannot write asmap cache: {e}', file=sys.stderr)
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+    return table
+
+def lookup_asns(asmap: Union[ASMap, IntervalASMap, ASMapLookupCache], ips: list[dict]) -> list[int]:
+    """ Look up the ASNs of the IPv4 and IPv6 entries `ips`.
+
+    With NumPy and a map that supports batched lookups, all addresses are looked up in two
+    batches; otherwise they are looked up one by one.
+    """
+    if not hasattr(asmap, 'lookup_many') or importlib.util.find_spec('numpy') is None:
+        return [asmap.lookup_int(ip['ipnum'], ip['net'] == 'ipv4') for ip in ips]
+    import numpy as np #pylint: disable=import-outside-toplevel
+    asns = np.zeros(len(ips), dtype=np.uint32)
+    is_v4 = np.array([ip['net'] == 'ipv4' for ip in ips], dtype=bool)
+    if is_v4.any():
+        asns[is_v4] = asmap.lookup_many(np.array([ip['ipnum'] for ip in ips if ip['net'] == 'ipv4'],
+                                                 dtype=np.uint32))
+    if not is_v4.all():
+        v6 = [(ip['ipnum'] >> 64, ip['ipnum'] & 0xffffffffffffffff) for ip in ips if ip['net'] != 'ipv4']
+        asns[~is_v4] = asmap.lookup_many(np.array(v6, dtype=np.uint64))
+    return asns.tolist()
+
 # Based on Greg Maxwell's seed_filter.py
-def filterbyasn(asmap: ASMap, ips: list[dict], max_per_asn: dict, max_per_net: int) -> list[dict]:
+def filterbyasn(asmap: Union[ASMap, IntervalASMap, ASMapLookupCache], ips: list[dict], max_per_asn: dict, max_per_net: int) -> list[dict]:
     """ Prunes `ips` by
     (a) trimming ips to have at most `max_per_net` ips from each net (e.g. ipv4, ipv6); and
     (b) trimming ips to have at most `max_per_asn` ips from each asn in each net.
@@ -164,12 +350,11 @@ def filterbyasn(asmap: ASMap, ips: list[dict], max_per_asn: dict, max_per_net: i
     net_count: dict[str, int] = collections.defaultdict(int)
     asn_count: dict[int, int] = collections.defaultdict(int)
 
-    for i, ip in enumerate(ips_ipv46):
+    for ip, asn in zip(ips_ipv46, lookup_asns(asmap, ips_ipv46)):
         if net_count[ip['net']] == max_per_net:
             # do not add this ip as we already too many
             # ips from this network
             continue
-        asn = asmap.lookup(net_to_prefix(ipaddress.ip_network(ip['ip'])))
         if not asn or asn_count[ip['net'], asn] == max_per_asn[ip['net']]:
             # do not add this ip as we already have too many
             # ips from this ASN on this network
@@ -187,72 +372,177 @@ def filterbyasn(asmap: ASMap, ips: list[dict], max_per_asn: dict, max_per_net: i
 
 def ip_stats(ips: list[dict]) -> str:
     """ Format and return pretty string from `ips`. """
-    hist: dict[str, int] = collections.defaultdict(int)
-    for ip in ips:
-        if ip is not None:
-            hist[ip['net']] += 1
+    return format_stats(collections.Counter(ip['net'] for ip in ips if ip is not None))
 
+def format_stats(hist: collections.Counter) -> str:
+    """ Format and return pretty string from the number of entries per net in `hist`. """
     return f"{hist['ipv4']:6d} {hist['ipv6']:6d} {hist['onion']:6d} {hist['i2p']:6d} {hist['cjdns']:6d}"
 
+class StageStats:
+    """ Records wall time, CPU time, peak RSS growth and record counts for the stages of a run. """
+
+    def __init__(self):
+        self.stages: list[dict] = []
+        self._start = self._sample()
+
+    @staticmethod
+    def _sample() -> tuple[float, float, Optional[int]]:
+        """ Return the wall time, the CPU time (including that of finished worker processes)
+        and the peak RSS in bytes, which is `None` where the resource module is missing.
+        """
+        try:
+            import resource #pylint: disable=import-outside-toplevel
+        except ImportError:
+            return time.perf_counter(), time.process_time(), None
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        cpu = usage.ru_utime + usage.ru_stime + children.ru_utime + children.ru_stime
+        # ru_maxrss is in bytes on macOS, and in KiB elsewhere.
+        rss = usage.ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+        return time.perf_counter(), cpu, rss
+
+    @contextlib.contextmanager
+    def stage(self, name: str, records_in: Optional[int] = None) -> Iterator[dict]:
+        """ Time the body of the with statement as stage `name`. The body sets the number of
+        resulting records as 'records_out' in the yielded dictionary.
+        """
+        entry = {'name': name, 'records_in': records_in, 'records_out': None}
+        wall, cpu, rss = self._sample()
+        yield entry
+        end_wall, end_cpu, end_rss = self._sample()
+        entry['wall_s'] = end_wall - wall
+        entry['cpu_s'] = end_cpu - cpu
+        entry['peak_rss_delta_bytes'] = None if rss is None else end_rss - rss
+        self.stages.append(entry)
+
+    def add(self, name: str, records_in: int, records_out: int, part_of: str) -> None:
+        """ Record the counts of stage `name`, which is not timed on its own but as part of
+        stage `part_of`.
+        """
+        self.stages.append({'name': name, 'records_in': records_in, 'records_out': records_out,
+                            'part_of': part_of})
+
+    def report(self) -> dict:
+        """ Return the stages and the totals of the run so far. """
+        wall, cpu, rss = self._sample()
+        return {
+            'stages': self.stages,
+            'total': {'wall_s': wall - self._start[0], 'cpu_s': cpu - self._start[1], 'peak_rss_bytes': rss},
+        }
+
+class TestMakeSeeds(unittest.TestCase):
+    """Unit tests for this module."""
+
+    LINES = [
+        '# address good lastSuccess %(2h) %(8h) %(1d) %(7d) %(30d) blocks svcs version',
+        '79.136.151.251:8333 1 1700810111 7.24% 53.59% 36.57% 5.80% 80.74% 841228 0000000000000409 70015 "/Satoshi:27.0.0/"',
+        '64.33.67.21:8333 1 1700991709 82.69% 12.38% 22.32% 62.74% 94.77% 848910 0000000000000c09 70015 "/Satoshi:27.0.0/"',
+        '64.33.67.21:8333 1 1700991710 82.69% 12.38% 22.32% 62.74% 95.77% 848910 0000000000000c09 70015 "/Satoshi:27.0.0/"',
+        '64.33.67.22:8333 1 1700991709 82.69% 12.38% 22.32% 62.74% 94.77% 848910 0000000000000c08 70015 "/Satoshi:27.0.0/"',
+        '1.2.3.4:99999 1 1700991709 82.69% 12.38% 22.32% 62.74% 94.77% 848910 0000000000000c09 70015 "/Satoshi:27.0.0/"',
+        '[2001:db8::1]:8333 1 1700358976 1.42% 97.09% 64.97% 52.66% 93.36% 844215 0000000000000409 70016 "/Satoshi:26.0.0/"',
+        '[2001:db8::1]:8334 1 1700358976 1.42% 97.09% 64.97% 52.66% 93.36% 844215 0000000000000409 70016 "/Satoshi:26.0.0/"',
+        '[fcc2:7625::4d45]:8333 1 1702956442 15.13% 65.85% 1.21% 83.11% 18.23% 839238 0000000000000409 70016 "/Satoshi:0.13.0/"',
+        'latjpuu5xfmzkp2ec6uk3geqfng274loi25phssrrxqqm4plppjsmuez.onion:8333 1 1704126343 50.73% 23.14% 80.84% 65.33% 99.10% 843353 0000000000000409 70015 "/Satoshi:26.1.0/"',
+        'latjpuu5xfmzkp2ec6uk3geqfng274loi25phssrrxqqm4plppjsmuez.onion:8334 1 1704126343 50.73% 23.14% 80.84% 65.33% 99.10% 843353 0000000000000409 70015 "/Satoshi:26.1.0/"',
+        'wovompzom7wbbr6qmw4wxfogo6mvn6a6wfhym6l3vfz5zfkkibj5j6wj.onion:8333 1 1700358976 1.42% 97.09% 64.97% 52.66% 93.36% 844215 0000000000000409 70016 "/Satoshi:27.0.0/"',
+    ]
+
+    def test_parseaddress(self) -> None:
+        """Test that addresses of every net are parsed, and invalid ones rejected."""
+        self.assertEqual(parseaddress('1.2.3.4:8333'), ('ipv4', '1.2.3.4', 8333, 0x01020304))
+        self.assertEqual(parseaddress('[::2]:8333'), ('ipv6', '::2', 8333, 2))
+        self.assertEqual(parseaddress('[fc00::1]:1'), ('cjdns', 'fc00::1', 1, (0xfc00 << 112) | 1))
+        for addr in ['1.2.3.4', '1.2.3.4:65536', '1.2.3.256:8333', '0.0.0.0:8333', '[::]:8333',
+                     '[::1:8333', 'abc.onion:8333']:
+            self.assertIsNone(parseaddress(addr))
+
+    def test_parse_and_filter(self) -> None:
+        """Test that duplicates and entries failing the filters are skipped."""
+        num_lines, ips, stats = merge_parsed([parse_and_filter(self.LINES, record_filters(MIN_BLOCKS))],
+                                             len(record_filters(MIN_BLOCKS)))
+        self.assertEqual(num_lines, len(self.LINES))
+        ips.sort(key=lambda x: (x['uptime'], x['lastsuccess'], x['ip']), reverse=True)
+        ips = filtermultiport(ips)
+        self.assertEqual([ip['ip'] for ip in ips],
+                         ['64.33.67.21', 'wovompzom7wbbr6qmw4wxfogo6mvn6a6wfhym6l3vfz5zfkkibj5j6wj.onion', '79.136.151.251'])
+        self.assertEqual([sum(counts.values()) for counts in stats], [10, 9, 8, 7, 7, 7])
+        self.assertEqual([f[0] for f in record_filters(MIN_BLOCKS)], ['minblocks', 'service', 'uptime', 'agent'])
+
+    def test_lookup_asns(self) -> None:
+        """Test that batched ASN lookups agree with lookups one by one."""
+        asmap = ASMap([([False] * 96 + [True, False], 2), ([True], 3), ([], 1)])
+        ips = [parseline(line) for line in self.LINES[1:]]
+        ips = [ip for ip in ips if ip is not None and ip['net'] in ('ipv4', 'ipv6')]
+        expected = [asmap.lookup_int(ip['ipnum'], ip['net'] == 'ipv4') for ip in ips]
+        self.assertEqual(lookup_asns(asmap, ips), expected)
+        self.assertEqual(lookup_asns(asmap.to_interval_map(), ips), expected)
+        self.assertEqual(lookup_asns(ASMapLookupCache(asmap, 4), ips), expected)
+
 def parse_args():
     argparser = argparse.ArgumentParser(description='Generate a list of bitcoin node seed ip addresses.')
     argparser.add_argument("-a","--asmap", help='the location of the asmap asn database file (required)', required=True)
     argparser.add_argument("-s","--seeds", help='the location of the DNS seeds file (required)', required=True)
     argparser.add_argument("-m", "--minblocks", help="The minimum number of blocks each node must have", default=MIN_BLOCKS, type=int)
+    argparser.add_argument("--asmap-cache", help=f'the directory for caching the decoded asmap (default: {DEFAULT_ASMAP_CACHE})', default=DEFAULT_ASMAP_CACHE, type=Path)
+    argparser.add_argument("--no-asmap-cache", help='do not cache the decoded asmap', action='store_true')
+    argparser.add_argument("-j", "--jobs", help='the number of processes for parsing the seeds file', default=1, type=int)
+    argparser.add_argument("--lookup-cache", help='the number of covering prefixes to keep in the ASN lookup cache (0 to disable)', default=0, type=int)
+    argparser.add_argument("--stats-json", help='write the time, CPU time, peak RSS growth and record counts (none for the asmap load) of every stage to this file as JSON')
     return argparser.parse_args()
 
 def main():
     args = parse_args()
+    stats_log = StageStats()
 
     print(f'Loading asmap database "{args.asmap}"…', end='', file=sys.stderr, flush=True)
-    with open(args.asmap, 'rb') as f:
-        asmap = ASMap.from_binary(f.read())
+    # Loading the asmap has no records in or out; both are reported as null.
+    with stats_log.stage('load asmap'):
+        asmap = load_asmap(args.asmap, None if args.no_asmap_cache else args.asmap_cache)
     print('Done.', file=sys.stderr)
 
     print('Loading and parsing DNS seeds…', end='', file=sys.stderr, flush=True)
-    with open(args.seeds, 'r', encoding='utf8') as f:
-        lines = f.readlines()
-    ips = [parseline(line) for line in lines]
-    random.shuffle(ips)
+    # Parse, skip entries with invalid address, skip duplicates (in case multiple seeds files
+    # were concatenated) and apply the per-entry filters, all while reading the file.
+    filters = record_filters(args.minblocks)
+    with stats_log.stage('parse') as stage:
+        num_lines, ips, stats = read_seeds(args.seeds, args.minblocks, args.jobs)
+        random.shuffle(ips)
+        # Records in are the lines of the seeds file, records out the valid entries.
+        stage['records_in'] = num_lines
+        stage['records_out'] = sum(stats[0].values())
+    stats_log.add('dedup', sum(stats[0].values()), sum(stats[1].values()), 'parse')
     print('Done.', file=sys.stderr)
+    for (filter_id, _, _), counts_in, counts_out in zip(filters, stats[1:], stats[2:]):
+        stats_log.add(filter_id, sum(counts_in.values()), sum(counts_out.values()), 'parse')
 
     print('\x1b[7m  IPv4   IPv6  Onion  I2P    CJDNS Pass                                               \x1b[0m', file=sys.stderr)
-    print(f'{ip_stats(ips):s} Initial', file=sys.stderr)
-    # Skip entries with invalid address.
-    ips = [ip for ip in ips if ip is not None]
-    print(f'{ip_stats(ips):s} Skip entries with invalid address', file=sys.stderr)
-    # Skip duplicates (in case multiple seeds files were concatenated)
-    ips = dedup(ips)
-    print(f'{ip_stats(ips):s} After removing duplicates', file=sys.stderr)
-    # Enforce minimal number of blocks.
-    ips = [ip for ip in ips if ip['blocks'] >= args.minblocks]
-    print(f'{ip_stats(ips):s} Enforce minimal number of blocks', file=sys.stderr)
-    # Require service bit 1.
-    ips = [ip for ip in ips if (ip['service'] & 1) == 1]
-    print(f'{ip_stats(ips):s} Require service bit 1', file=sys.stderr)
-    # Require at least 50% 30-day uptime for clearnet, onion and i2p; 10% for cjdns
-    req_uptime = {
-        'ipv4': 50,
-        'ipv6': 50,
-        'onion': 50,
-        'i2p': 50,
-        'cjdns': 10,
-    }
-    ips = [ip for ip in ips if ip['uptime'] > req_uptime[ip['net']]]
-    print(f'{ip_stats(ips):s} Require minimum uptime', file=sys.stderr)
-    # Require a known and recent user agent.
-    ips = [ip for ip in ips if PATTERN_AGENT.match(ip['agent'])]
-    print(f'{ip_stats(ips):s} Require a known and recent user agent', file=sys.stderr)
+    print(f'{format_stats(stats[0]):s} Initial', file=sys.stderr)
+    print(f'{format_stats(stats[0]):s} Skip entries with invalid address', file=sys.stderr)
+    print(f'{format_stats(stats[1]):s} After removing duplicates', file=sys.stderr)
+    for (_, description, _), counts in zip(filters, stats[2:]):
+        print(f'{format_stats(counts):s} {description}', file=sys.stderr)
     # Sort by availability (and use last success as tie breaker)
-    ips.sort(key=lambda x: (x['uptime'], x['lastsuccess'], x['ip']), reverse=True)
+    with stats_log.stage('sort', len(ips)) as stage:
+        ips.sort(key=lambda x: (x['uptime'], x['lastsuccess'], x['ip']), reverse=True)
+        stage['records_out'] = len(ips)
     # Filter out hosts with multiple bitcoin ports, these are likely abusive
-    ips = filtermultiport(ips)
+    with stats_log.stage('multiport', len(ips)) as stage:
+        ips = filtermultiport(ips)
+        stage['records_out'] = len(ips)
     print(f'{ip_stats(ips):s} Filter out hosts with multiple bitcoin ports', file=sys.stderr)
     # Look up ASNs and limit results, both per ASN and globally.
-    ips = filterbyasn(asmap, ips, MAX_SEEDS_PER_ASN, NSEEDS)
+    lookup_cache = ASMapLookupCache(asmap, args.lookup_cache) if args.lookup_cache > 0 else None
+    with stats_log.stage('asn filter', len(ips)) as stage:
+        ips = filterbyasn(asmap if lookup_cache is None else lookup_cache, ips, MAX_SEEDS_PER_ASN, NSEEDS)
+        stage['records_out'] = len(ips)
     print(f'{ip_stats(ips):s} Look up ASNs and limit results per ASN and per net', file=sys.stderr)
+    if lookup_cache is not None:
+        print(f'ASN lookup cache: {lookup_cache.hits} hits, {lookup_cache.misses} misses', file=sys.stderr)
     # Sort the results by IP address (for deterministic output).
-    ips.sort(key=lambda x: (x['net'], x['sortkey']))
+    with stats_log.stage('output sort', len(ips)) as stage:
+        ips.sort(key=lambda x: (x['net'], x['sortkey']))
+        stage['records_out'] = len(ips)
     for ip in ips:
         if ip['net'] == 'ipv6' or ip["net"] == "cjdns":
             print(f"[{ip['ip']}]:{ip['port']}", end="")
@@ -262,5 +552,12 @@ def main():
             print(f" # AS{ip['asn']}", end="")
         print()
 
+    if args.stats_json is not None:
+        report = stats_log.report()
+        report['options'] = {'asmap': args.asmap, 'seeds': args.seeds, 'minblocks': args.minblocks,
+                             'jobs': args.jobs, 'lookup_cache': args.lookup_cache}
+        with open(args.stats_json, 'w', encoding='utf8') as f:
+            f.write(json.dumps(report, indent=2) + '\n')
+
 if __name__ == '__main__':
     main()